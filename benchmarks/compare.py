@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+
+METRICS = [
+    "build_seconds",
+    "query_p50_seconds",
+    "query_p95_seconds",
+    "peak_rss_mb",
+]
+
+
+def model(case):
+    # "tiny" for the random models of benchmarks/tiny_models.py
+    return case.get("model", "configured")
+
+
+def load_cases(fname):
+    with open(fname) as f:
+        results = json.load(f)
+    cases = {(c["module"], c["backend"], c["size"]): c for c in results["cases"]}
+    return results, cases
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="compare two benchmarks/run.py results")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="mark relative changes above this fraction",
+    )
+    args = p.parse_args()
+
+    base, base_cases = load_cases(args.baseline)
+    cand, cand_cases = load_cases(args.candidate)
+    print(f"baseline {base['commit']} vs candidate {cand['commit']}")
+
+    for key in sorted(base_cases.keys() & cand_cases.keys(), key=str):
+        b, c = base_cases[key], cand_cases[key]
+        name = "{}/{}".format(*key[:2])
+        if key[2] is not None:
+            name += f" ({key[2]} concepts)"
+        if "error" in b or "error" in c:
+            print(f"{name}: {b.get('error', 'ok')} -> {c.get('error', 'ok')}")
+            continue
+        if model(b) != model(c):
+            print(f"{name}: {model(b)} models -> {model(c)} models, skipped")
+            continue
+        if model(b) == "tiny":
+            name += " [tiny models]"
+        for metric in METRICS:
+            change = (c[metric] - b[metric]) / b[metric] if b[metric] else 0.0
+            flag = " <--" if abs(change) > args.threshold else ""
+            print(
+                f"{name:55} {metric:20} {b[metric]:10.4f} -> {c[metric]:10.4f}"
+                f" ({change:+.1%}){flag}"
+            )
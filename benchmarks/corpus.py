@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import itertools
+import json
+import random
+from pathlib import Path
+
+# vocabulary for Dutch radiology-style concepts and reports
+# fmt: off
+ANATOMY = [
+    "lever", "nier", "milt", "pancreas", "long", "longkwab", "bovenkwab",
+    "onderkwab", "middenkwab", "mediastinum", "hilus", "pleura", "galblaas",
+    "blaas", "prostaat", "uterus", "ovarium", "adnex", "bijnier", "aorta",
+    "vena cava", "arteria pulmonalis", "wervel", "wervelkolom", "bekken", "heup",
+    "schouder", "knie", "enkel", "schedel", "hersenen", "cerebellum", "hypofyse",
+    "schildklier", "oksel", "lies", "mesenterium", "colon", "caecum", "rectum",
+    "duodenum", "maag", "slokdarm", "trachea", "bronchus", "hart", "pericard",
+    "thoraxwand", "buikwand", "peritoneum",
+]
+FINDINGS = [
+    "laesie", "cyste", "nodus", "noduli", "massa", "infiltraat", "consolidatie",
+    "atelectase", "effusie", "vochtcollectie", "abces", "fractuur", "luxatie",
+    "stenose", "occlusie", "aneurysma", "dissectie", "embolie", "trombus",
+    "verkalking", "concrement", "lymfeklier", "metastase", "tumor", "poliep",
+    "divertikel", "hernia", "hematoom", "oedeem", "ontsteking", "fibrose",
+    "emfyseem", "bronchiectasie", "pneumothorax", "ascites", "hydronefrose",
+    "steatose", "cirrose", "spondylodiscitis", "artrose",
+]
+MODIFIERS = [
+    "hypodense", "hyperdense", "solide", "cysteuze", "multiloculaire", "diffuse",
+    "focale", "bilaterale", "linkszijdige", "rechtszijdige", "centrale",
+    "perifere", "acute", "chronische", "partiële", "complete", "kleine", "grote",
+    "multipele", "solitaire", "aankleurende", "necrotische", "gecalcificeerde",
+    "spiculaire", "lobulaire", "subpleurale", "periportale", "paravertebrale",
+    "mesenteriale", "retroperitoneale",
+]
+TEMPLATES = [
+    "Er is een {mod} {finding} in de {anat} van {size} mm.",
+    "Geen aanwijzingen voor {finding} van de {anat}.",
+    "Vergeleken met het vorige onderzoek is de {finding} in de {anat} {change}.",
+    "Status na resectie van de {anat}, geen {mod} {finding}.",
+    "Bekende {finding} van de {anat}, {change} ten opzichte van eerder.",
+    "De {anat} is normaal van grootte en aspect.",
+    "Mogelijk {mod} {finding} ter plaatse van de {anat}, DD {finding2}.",
+    "Conclusie: {mod} {finding} {anat}, advies follow-up over {months} maanden.",
+]
+CHANGES = ["afgenomen", "toegenomen", "stationair", "nieuw", "verdwenen"]
+# fmt: on
+
+
+def make_entities(n, seed=0):
+    """n unique concepts "<modifier> [<modifier>] <finding> <anatomy>"."""
+    rng = random.Random(seed)
+    combinations = itertools.chain(
+        itertools.product(MODIFIERS, FINDINGS, ANATOMY),
+        (
+            (f"{m1} {m2}", f, a)
+            for m1, m2 in itertools.permutations(MODIFIERS, 2)
+            for f in FINDINGS
+            for a in ANATOMY
+        ),
+    )
+    for i, (mod, finding, anat) in enumerate(itertools.islice(combinations, n)):
+        ent = {
+            "title": f"{mod} {finding} {anat}",
+            "description": f"Een {mod} {finding} gelokaliseerd in de {anat}.",
+            "url": "",
+            "source": "synthetic",
+            "source_id": str(i),
+        }
+        if rng.random() < 0.2:
+            ent["synonyms"] = [f"{finding} {anat}", f"{anat}{finding}"]
+        yield ent
+
+
+def make_report(rng, num_sentences=8):
+    sentences = []
+    for _ in range(num_sentences):
+        sentences.append(
+            rng.choice(TEMPLATES).format(
+                mod=rng.choice(MODIFIERS),
+                finding=rng.choice(FINDINGS),
+                finding2=rng.choice(FINDINGS),
+                anat=rng.choice(ANATOMY),
+                size=rng.randint(2, 80),
+                change=rng.choice(CHANGES),
+                months=rng.choice([3, 6, 12]),
+            )
+        )
+    # reports are typed by hand, so the whitespace is irregular
+    return "".join(s + rng.choice([" ", "  ", "\n", "\n\n"]) for s in sentences)
+
+
+def make_reports(n, seed=0, min_sentences=3, max_sentences=30):
+    rng = random.Random(seed)
+    return [
+        make_report(rng, rng.randint(min_sentences, max_sentences)) for _ in range(n)
+    ]
+
+
+def make_queries(entities, n, seed=0):
+    """Search queries: entity titles, prefixes and titles with a typo."""
+    rng = random.Random(seed)
+    queries = []
+    for ent in rng.sample(entities, min(n, len(entities))):
+        title = ent["title"]
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(title.split()[-2])
+        elif kind < 0.7 and len(title) > 4:
+            i = rng.randrange(1, len(title) - 1)
+            queries.append(title[:i] + title[i + 1 :])
+        else:
+            queries.append(title)
+    return queries
+
+
+def write_entity_list(directory, n, seed=0):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "synthetic.jsonl", "w") as f:
+        for ent in make_entities(n, seed):
+            print(json.dumps(ent), file=f)
+    with open(directory / "blacklist", "w") as f:
+        print("geen aanwijzingen", file=f)
+        print("normaal", file=f)
+    return directory
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("output_dir", type=Path)
+    p.add_argument("--entities", type=int, default=10_000)
+    p.add_argument("--reports", type=int, default=1_000)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    write_entity_list(args.output_dir / "entity_lists", args.entities, args.seed)
+    with open(args.output_dir / "reports.jsonl", "w") as f:
+        for report in make_reports(args.reports, args.seed):
+            print(json.dumps({"text": report}), file=f)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import subprocess
+import sys
+from statistics import median
+
+# backend dependencies that should only be imported when a backend using them is
+# constructed, never when importing the API module itself
+HEAVY_MODULES = [
+    "faiss",
+    "flair",
+    "gensim",
+    "nltk",
+    "peft",
+    "simstring",
+    "spacy",
+    "torch",
+    "transformers",
+]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": sorted(m for m in {heavy} if m in sys.modules),
+}}))
+"""
+
+
+def measure(module):
+    # fresh interpreter per run, so nothing is cached in sys.modules
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout)
+
+
+def slowest_imports(module, top):
+    # parse `python -X importtime` output: "import time: self | cumulative | name"
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--module", default="simplerad.simplerad")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=15)
+    p.add_argument("--output", help="write the results to this json file")
+    args = p.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    results = {
+        "module": args.module,
+        "runs": args.runs,
+        "median_seconds": median(r["seconds"] for r in runs),
+        "median_max_rss_mb": median(r["max_rss_mb"] for r in runs),
+        "heavy_modules": runs[0]["heavy_modules"],
+        "slowest_imports": slowest_imports(args.module, args.top),
+    }
+
+    print(f"import {args.module}: {results['median_seconds']:.3f}s (median)")
+    print(f"max RSS: {results['median_max_rss_mb']:.1f} MB")
+    for seconds, name in results["slowest_imports"]:
+        print(f"{seconds:8.3f}s  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if results["heavy_modules"]:
+        print(f"eagerly imported backend dependencies: {results['heavy_modules']}")
+        sys.exit(1)
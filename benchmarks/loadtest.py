@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import http.client
+import json
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from statistics import quantiles
+from urllib.parse import urlsplit
+
+import corpus
+
+# every model-based module runs on its stand-in, search on the exact matcher
+STUB_OVERRIDES = [
+    "entities=stub",
+    "text_classification=stub",
+    "sentence_classification=stub",
+    "summarize=stub",
+    "prevalence=stub",
+    "search=exact",
+]
+
+# endpoint -> relative frequency in the request mix
+MIX = {
+    "/search/": 40,
+    "/entities/": 15,
+    "/prevalence/global": 15,
+    "/prevalence/local": 10,
+    "/sentence_classification/": 8,
+    "/text_classification/": 8,
+    "/summarize/": 4,
+}
+
+
+class Workload:
+    def __init__(self, entity_list, num_reports, batch_sizes, max_items, seed=0):
+        self.rng = random.Random(seed)
+        self.reports = corpus.make_reports(num_reports, seed=seed)
+        self.queries = corpus.make_queries(entity_list, 1000, seed=seed)
+        self.terms = [ent["title"] for ent in entity_list[:1000]]
+        self.batch_sizes = batch_sizes
+        # endpoint -> items per request the server accepts, larger batches are capped
+        self.max_items = max_items
+        self.lock = threading.Lock()
+
+    def item(self, endpoint):
+        if endpoint == "/search/":
+            return {"text": self.rng.choice(self.queries)}
+        if endpoint == "/prevalence/global":
+            return {"text": self.rng.choice(self.terms)}
+        if endpoint == "/prevalence/local":
+            return {
+                "text": self.rng.choice(self.terms),
+                "context": self.rng.choice(self.reports),
+            }
+        return {"text": self.rng.choice(self.reports)}
+
+    def request(self):
+        with self.lock:
+            endpoint = self.rng.choices(list(MIX), weights=list(MIX.values()))[0]
+            batch_size = self.rng.choice(self.batch_sizes)
+            if self.max_items.get(endpoint, -1) >= 0:
+                batch_size = min(batch_size, self.max_items[endpoint])
+            body = [self.item(endpoint) for _ in range(batch_size)]
+        return endpoint, batch_size, body
+
+
+def worker(url, workload, deadline, warmup_until, results):
+    parts = urlsplit(url)
+    # one keep-alive connection per worker, like a browser tab or a batch client
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=300)
+    headers = {"Content-Type": "application/json"}
+    while time.perf_counter() < deadline:
+        endpoint, batch_size, body = workload.request()
+        body = json.dumps(body)
+        start = time.perf_counter()
+        try:
+            conn.request("POST", endpoint, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        end = time.perf_counter()
+        if start >= warmup_until:
+            results.append((endpoint, batch_size, end - start, ok, end))
+    conn.close()
+
+
+def summarize(rows, seconds):
+    latencies = sorted(r[2] for r in rows if r[3])
+    if len(latencies) >= 2:
+        q = quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else None
+    return {
+        "requests": len(rows),
+        "errors": sum(not r[3] for r in rows),
+        "requests_per_second": len(rows) / seconds,
+        "items_per_second": sum(r[1] for r in rows if r[3]) / seconds,
+        "p50_seconds": p50,
+        "p95_seconds": p95,
+        "p99_seconds": p99,
+    }
+
+
+def report(results, seconds):
+    by_endpoint = defaultdict(list)
+    by_batch = defaultdict(list)
+    for row in results:
+        by_endpoint[row[0]].append(row)
+        by_batch[(row[0], row[1])].append(row)
+    return {
+        "seconds": seconds,
+        "total": summarize(results, seconds),
+        "endpoints": {e: summarize(rows, seconds) for e, rows in by_endpoint.items()},
+        "batch_sizes": [
+            {"endpoint": e, "batch_size": b, **summarize(rows, seconds)}
+            for (e, b), rows in sorted(by_batch.items())
+        ],
+    }
+
+
+def print_report(results):
+    def fmt(x):
+        return f"{x * 1000:8.1f}" if x is not None else "       -"
+
+    print(f"{'endpoint':28} {'req/s':>8} {'items/s':>8} {'p50 ms':>8} ", end="")
+    print(f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    rows = list(results["endpoints"].items()) + [("total", results["total"])]
+    for name, r in rows:
+        print(
+            f"{name:28} {r['requests_per_second']:8.1f} {r['items_per_second']:8.1f} "
+            f"{fmt(r['p50_seconds'])} {fmt(r['p95_seconds'])} "
+            f"{fmt(r['p99_seconds'])} {r['errors']:6d}"
+        )
+    print()
+    print(f"{'endpoint':28} {'batch':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results["batch_sizes"]:
+        print(
+            f"{r['endpoint']:28} {r['batch_size']:6d} {r['requests_per_second']:8.1f} "
+            f"{fmt(r['p50_seconds'])} {fmt(r['p95_seconds'])}"
+        )
+
+
+def max_items(cfg):
+    # the server answers larger requests with 413, which would be measured as errors
+    from simplerad.admission import Admission
+
+    if not cfg.admission.enabled:
+        return {}
+    admission = Admission()
+    admission.set_config(cfg.admission)
+    return {endpoint: admission.settings(endpoint)["max_items"] for endpoint in MIX}
+
+
+def load_config(overrides, serve):
+    """The Hydra config, the app is configured with it when it is served here."""
+    from hydra import compose, initialize_config_module
+
+    from simplerad.simplerad import configure
+
+    with initialize_config_module(config_module="simplerad.conf", version_base=None):
+        cfg = compose(config_name="config", overrides=overrides)
+        if serve:
+            configure(cfg, overrides)
+    return cfg
+
+
+def start_server():
+    """Serve the configured app from a background thread."""
+    import uvicorn
+
+    from simplerad.simplerad import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "overrides",
+        nargs="*",
+        help="hydra overrides on top of the stand-in models, e.g. entities.latency_ms=20",
+    )
+    p.add_argument("--url", help="load test a running server instead")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--duration", type=float, default=30, help="seconds")
+    p.add_argument("--warmup", type=float, default=5, help="seconds, not reported")
+    p.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 1, 1, 5, 20, 50])
+    p.add_argument("--entities", type=int, default=10_000)
+    p.add_argument("--reports", type=int, default=500)
+    p.add_argument("--output", type=Path, help="write the results to this json file")
+    args = p.parse_args()
+
+    entity_list = list(corpus.make_entities(args.entities))
+    url = args.url
+    if url is None:
+        data_dir = Path(tempfile.mkdtemp(prefix="simplerad-load-")) / "entity_lists"
+        corpus.write_entity_list(data_dir, args.entities)
+        overrides = STUB_OVERRIDES + [f"search.jsonl_directory={data_dir}"]
+        cfg = load_config(overrides + args.overrides, serve=True)
+        url = start_server()
+    else:
+        # the item limits of a running server are assumed to be those of this config
+        cfg = load_config(args.overrides, serve=False)
+
+    workload = Workload(entity_list, args.reports, args.batch_sizes, max_items(cfg))
+    start = time.perf_counter()
+    warmup_until = start + args.warmup
+    deadline = warmup_until + args.duration
+    results = []
+    threads = [
+        threading.Thread(
+            target=worker, args=(url, workload, deadline, warmup_until, results)
+        )
+        for _ in range(args.concurrency)
+    ]
+    print(
+        f"{args.concurrency} workers against {url} for {args.duration}s...",
+        file=sys.stderr,
+    )
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    results = report(results, args.duration)
+    results["concurrency"] = args.concurrency
+    results["overrides"] = args.overrides
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
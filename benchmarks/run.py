@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import mean, quantiles
+
+from omegaconf import OmegaConf
+
+import corpus
+import tiny_models
+
+CONF_DIR = Path(__file__).parents[1] / "src" / "simplerad" / "conf"
+
+# module -> backend -> config group option it is benchmarked with
+BACKENDS = {
+    "search": {
+        "exact": "exact",
+        "simstring": "simstring",
+        "simstring_sharded": "simstring_sharded",
+        "bm25": "bm25",
+        "faiss": "dense",
+    },
+    "entities": {
+        "simstring": "simstring",
+        "flair": "flair",
+        "stub": "stub",
+    },
+    "sentence_classification": {"flair": "flair", "stub": "stub"},
+    "text_classification": {"flair": "flair", "stub": "stub"},
+    "summarize": {"transformer_abstractive": "transformer_abstractive", "stub": "stub"},
+    "prevalence": {
+        "global_sklearn": "global_sklearn",
+        "global_local_adapter": "global_local_adapter",
+        "stub": "stub",
+    },
+}
+# one call of a backend per query
+CALLS = {
+    "search": lambda model, query: model.search(query),
+    "entities": lambda model, query: model.predict(query),
+    "sentence_classification": lambda model, query: model.predict(query),
+    "text_classification": lambda model, query: model.predict(query),
+    "summarize": lambda model, query: model.summarize(query["text"]),
+    "prevalence": lambda model, query: model.get_global_prevalence(query),
+}
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        return {"p50": latencies[0], "p95": latencies[0], "p99": latencies[0]}
+    q = quantiles(latencies, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98]}
+
+
+def peak_rss_mb():
+    # VmHWM is reset on exec, unlike ru_maxrss which keeps the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def train_fasttext(data_dir, reports):
+    # tiny local model for the dense searcher, trained on the synthetic corpus
+    from gensim.models import FastText
+
+    from simplerad.utils import read_jsonl_dir, simple_tokenize
+
+    sentences = [simple_tokenize(r) for r in reports]
+    sentences += [
+        simple_tokenize(e["title"]) for e in read_jsonl_dir(data_dir / "entity_lists")
+    ]
+    model = FastText(vector_size=32, window=3, min_count=1, epochs=1)
+    model.build_vocab(corpus_iterable=sentences)
+    model.train(corpus_iterable=sentences, total_examples=len(sentences), epochs=1)
+    path = data_dir / "fasttext.bin"
+    model.save(str(path))
+    return path
+
+
+def backend_config(module, backend, data_dir, overrides=()):
+    option = BACKENDS[module].get(backend, backend)
+    cfg = OmegaConf.load(CONF_DIR / module / f"{option}.yaml")
+    cfg.name = backend
+    if "jsonl_directory" in cfg:
+        cfg.jsonl_directory = str(data_dir / "entity_lists")
+    if "spacy_model" in cfg:
+        # no model download needed, the backends only use the tokenizer
+        cfg.spacy_model = "blank:nl"
+    if backend == "faiss":
+        cfg.fasttext_path = str(data_dir / "fasttext.bin")
+    # e.g. paths of the trained models, from --set
+    return OmegaConf.merge(cfg, OmegaConf.from_dotlist(list(overrides)))
+
+
+def uses_entity_lists(module, backend):
+    # other backends do not depend on the size of the entity lists, they run once
+    return "jsonl_directory" in backend_config(module, backend, Path("."))
+
+
+def make_queries(module, size, num_queries):
+    from simplerad.utils import preprocess
+
+    if module == "search":
+        return corpus.make_queries(list(corpus.make_entities(size)), num_queries, 1)
+    if module == "prevalence":
+        entity_list = list(corpus.make_entities(num_queries))
+        terms = corpus.make_queries(entity_list, num_queries, seed=1)
+        return [preprocess(t)["text"] for t in terms]
+    return [preprocess(r) for r in corpus.make_reports(num_queries, seed=1)]
+
+
+def run_case(module, backend, data_dir, size, num_queries, overrides):
+    """Build one backend and time its queries, meant to run in a fresh process."""
+    from simplerad import classification, entities, prevalence, search, summarization
+    from simplerad.utils import current_rss, import_string
+
+    registry = {
+        "search": search.searchers,
+        "entities": entities.entity_taggers,
+        "sentence_classification": classification.sentence_classifiers,
+        "text_classification": classification.text_classifiers,
+        "summarize": summarization.summarizers,
+        "prevalence": prevalence.prevalencers,
+    }[module]
+    queries = make_queries(module, size, num_queries)
+
+    cls = import_string(registry.backends[backend])
+    cfg = backend_config(module, backend, data_dir, overrides)
+    rss_before = current_rss()
+    start = time.perf_counter()
+    model = cls(cfg)
+    build_seconds = time.perf_counter() - start
+    rss_model = current_rss() - rss_before
+
+    call = CALLS[module]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        call(model, query)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "build_seconds": build_seconds,
+        "query_mean_seconds": mean(latencies),
+        **{f"query_{k}_seconds": v for k, v in percentiles(latencies).items()},
+        "model_rss_mb": rss_model / 2**20,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_preprocess(num_reports):
+    from simplerad.utils import preprocess, preprocess_cache, segment_uncached
+
+    reports = corpus.make_reports(num_reports, seed=2)
+    results = {}
+    for name, fn in [("uncached", segment_uncached), ("cached", preprocess)]:
+        preprocess_cache.clear()
+        for r in reports:
+            # warm the cache for the cached run, and the tokenizer for both
+            preprocess(r)
+        latencies = []
+        for r in reports:
+            start = time.perf_counter()
+            fn(r)
+            latencies.append(time.perf_counter() - start)
+        results[name] = {
+            "mean_seconds": mean(latencies),
+            **{f"{k}_seconds": v for k, v in percentiles(latencies).items()},
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_data(root, size, num_reports, fasttext):
+    data_dir = root / f"entities_{size}"
+    if not (data_dir / "entity_lists").exists():
+        corpus.write_entity_list(data_dir / "entity_lists", size)
+    if fasttext and not (data_dir / "fasttext.bin").exists():
+        train_fasttext(data_dir, corpus.make_reports(num_reports))
+    return data_dir
+
+
+def parse_overrides(items):
+    # "module/backend.key=value" -> {"module/backend": ["key=value"]}
+    overrides = {}
+    for item in items:
+        case, _, setting = item.partition(".")
+        overrides.setdefault(case, []).append(setting)
+    return overrides
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--output", type=Path, default=Path("benchmark_results.json"))
+    p.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    p.add_argument(
+        "--backends",
+        nargs="+",
+        help="module/backend pairs to run, e.g. search/bm25 (default: all)",
+    )
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--timeout", type=int, default=1800, help="seconds per case")
+    p.add_argument("--data_dir", type=Path, help="reuse generated corpora")
+    p.add_argument(
+        "--set",
+        nargs="+",
+        default=[],
+        help="config values per backend, e.g. entities/flair.model_name=model.pt",
+    )
+    p.add_argument(
+        "--configured_models",
+        action="store_true",
+        help="load the trained models of the configs instead of tiny random ones",
+    )
+    p.add_argument("--worker", nargs=4, help=argparse.SUPPRESS)
+    args = p.parse_args()
+    overrides = parse_overrides(args.set)
+
+    if args.worker:
+        module, backend, data_dir, size = args.worker
+        result = run_case(
+            module,
+            backend,
+            Path(data_dir),
+            int(size),
+            args.queries,
+            overrides.get(f"{module}/{backend}", []),
+        )
+        print(json.dumps(result))
+        sys.exit(0)
+
+    cases = [
+        (module, backend)
+        for module, backends in BACKENDS.items()
+        for backend in backends
+        if not args.backends or f"{module}/{backend}" in args.backends
+    ]
+    data_root = args.data_dir or Path(tempfile.mkdtemp(prefix="simplerad-bench-"))
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "preprocess": run_preprocess(args.queries),
+        "cases": [],
+    }
+
+    # tiny models are built here, so building them is not part of the measurements
+    tiny = {}
+    for module, backend in cases:
+        name = f"{module}/{backend}"
+        if name in tiny_models.BUILDERS and not args.configured_models:
+            print(f"{name}: building tiny models...", file=sys.stderr)
+            try:
+                texts = corpus.make_reports(args.queries)
+                tiny[name] = tiny_models.build(data_root / "tiny_models", name, texts)
+            except Exception as e:
+                tiny[name] = e
+
+    for i, size in enumerate(args.sizes):
+        fasttext = ("search", "faiss") in cases
+        data_dir = prepare_data(data_root, size, args.queries, fasttext)
+        for module, backend in cases:
+            sized = uses_entity_lists(module, backend)
+            if not sized and i > 0:
+                continue
+            name = f"{module}/{backend}"
+            print(
+                f"{name} with {size} concepts..." if sized else f"{name}...",
+                file=sys.stderr,
+            )
+            case = {
+                "module": module,
+                "backend": backend,
+                "size": size if sized else None,
+            }
+            if isinstance(tiny.get(name), Exception):
+                e = tiny[name]
+                case["error"] = f"tiny models: {type(e).__name__}: {e}"
+                results["cases"].append(case)
+                continue
+            # the values of --set come last, so they win over those of the tiny models
+            settings = [f"{name}.{v}" for v in tiny.get(name, [])] + args.set
+            if name in tiny:
+                case["model"] = "tiny"
+            worker = ["--worker", module, backend, str(data_dir), str(size)]
+            if settings:
+                worker += ["--set", *settings]
+            try:
+                out = subprocess.run(
+                    [sys.executable, __file__, "--queries", str(args.queries)] + worker,
+                    capture_output=True,
+                    text=True,
+                    timeout=args.timeout,
+                )
+                if out.returncode == 0:
+                    case.update(json.loads(out.stdout.splitlines()[-1]))
+                else:
+                    case["error"] = out.stderr.strip().splitlines()[-1]
+            except subprocess.TimeoutExpired:
+                case["error"] = f"timeout after {args.timeout}s"
+            results["cases"].append(case)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
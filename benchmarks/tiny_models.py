@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tiny randomly initialized models for the backends that need trained models, so
+# that benchmarks/run.py measures their own code paths offline: flair Sentences and
+# predict() with mini batches, Hugging Face tokenizers and generate(), and the
+# switching of LoRA adapters. Their weights are a fraction of the trained models,
+# so the timings show the overhead around the models rather than their real cost.
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+SPECIAL_TOKENS = ["<pad>", "<unk>", "<s>", "</s>", "<mask>"]
+TAGS = ["O", "S-FINDING", "B-FINDING", "I-FINDING", "E-FINDING"]
+LABELS = ["POSITIVE", "NEGATIVE"]
+# small, but with room for the longest synthetic reports
+HIDDEN_SIZE = 32
+MAX_POSITIONS = 4096
+
+
+def words(texts):
+    return sorted({word for text in texts for word in text.split()})
+
+
+def flair_embeddings(texts):
+    from flair.data import Dictionary
+    from flair.embeddings import OneHotEmbeddings
+
+    # OneHotEmbeddings logs its whole vocabulary
+    logging.getLogger("flair").setLevel(logging.WARNING)
+    vocabulary = Dictionary(add_unk=True)
+    for word in words(texts):
+        vocabulary.add_item(word)
+    return OneHotEmbeddings(vocabulary, embedding_length=HIDDEN_SIZE)
+
+
+def flair_tagger(path: Path, texts):
+    from flair.data import Dictionary
+    from flair.models import SequenceTagger
+
+    tags = Dictionary(add_unk=False)
+    for tag in TAGS:
+        tags.add_item(tag)
+    tagger = SequenceTagger(
+        hidden_size=HIDDEN_SIZE,
+        embeddings=flair_embeddings(texts),
+        tag_dictionary=tags,
+        tag_type="ner",
+        use_crf=True,
+    )
+    tagger.save(path / "tagger.pt")
+    return [f"model_name={path / 'tagger.pt'}"]
+
+
+def flair_classifier(path: Path, texts):
+    from flair.data import Dictionary
+    from flair.embeddings import DocumentPoolEmbeddings
+    from flair.models import TextClassifier
+
+    labels = Dictionary(add_unk=False)
+    for label in LABELS:
+        labels.add_item(label)
+    classifier = TextClassifier(
+        DocumentPoolEmbeddings([flair_embeddings(texts)]),
+        label_type="class",
+        label_dictionary=labels,
+    )
+    classifier.save(path / "classifier.pt")
+    return [f"model_name={path / 'classifier.pt'}"]
+
+
+def tokenizer(path: Path, texts):
+    # a word level tokenizer trained on the synthetic corpus, with the special
+    # tokens of a BART/RoBERTa tokenizer
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tokens = Tokenizer(models.WordLevel(unk_token="<unk>"))
+    tokens.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokens.train_from_iterator(
+        texts, trainers.WordLevelTrainer(special_tokens=SPECIAL_TOKENS)
+    )
+    tokens.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[(t, tokens.token_to_id(t)) for t in ("<s>", "</s>")],
+    )
+    fast = PreTrainedTokenizerFast(
+        tokenizer_object=tokens,
+        model_max_length=MAX_POSITIONS,
+        # like the BART/RoBERTa tokenizers, no token_type_ids
+        model_input_names=["input_ids", "attention_mask"],
+        pad_token="<pad>",
+        unk_token="<unk>",
+        bos_token="<s>",
+        eos_token="</s>",
+        cls_token="<s>",
+        sep_token="</s>",
+        mask_token="<mask>",
+    )
+    fast.save_pretrained(path)
+    return fast
+
+
+def encoder(path: Path, texts):
+    from transformers import AutoModelForSequenceClassification, BertConfig
+
+    vocabulary = tokenizer(path, texts)
+    config = BertConfig(
+        vocab_size=len(vocabulary),
+        hidden_size=HIDDEN_SIZE,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=2 * HIDDEN_SIZE,
+        max_position_embeddings=MAX_POSITIONS,
+        pad_token_id=vocabulary.pad_token_id,
+        num_labels=1,
+    )
+    AutoModelForSequenceClassification.from_config(config).save_pretrained(path)
+
+
+def summarizer(path: Path, texts):
+    from transformers import AutoModelForSeq2SeqLM, BartConfig
+
+    vocabulary = tokenizer(path, texts)
+    config = BartConfig(
+        vocab_size=len(vocabulary),
+        d_model=HIDDEN_SIZE,
+        encoder_layers=1,
+        decoder_layers=1,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=2 * HIDDEN_SIZE,
+        decoder_ffn_dim=2 * HIDDEN_SIZE,
+        max_position_embeddings=MAX_POSITIONS,
+        pad_token_id=vocabulary.pad_token_id,
+        bos_token_id=vocabulary.bos_token_id,
+        eos_token_id=vocabulary.eos_token_id,
+        decoder_start_token_id=vocabulary.eos_token_id,
+    )
+    AutoModelForSeq2SeqLM.from_config(config).save_pretrained(path)
+    return [f"tokenizer={path}", f"model={path}"]
+
+
+def bin_errors(path: Path):
+    # the table of scripts/calculate_error_bins.py
+    path.mkdir(parents=True, exist_ok=True)
+    np.save(path / "bin_errors.npy", np.full(10, 0.1))
+
+
+def adapter_prevalence(path: Path, texts):
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForSequenceClassification
+
+    base = path / "base"
+    encoder(base, texts)
+    for adapter in ("global", "local"):
+        # a config per adapter, get_peft_model adds the head to its modules_to_save
+        config = LoraConfig(
+            r=2,
+            lora_alpha=4,
+            target_modules=["query", "value"],
+            task_type="SEQ_CLS",
+            # random adapters, so switching between them changes the predictions
+            init_lora_weights=False,
+        )
+        model = AutoModelForSequenceClassification.from_pretrained(base, num_labels=1)
+        # backends load adapter_model/adapter_model.bin with torch.load
+        get_peft_model(model, config).save_pretrained(
+            path / adapter / "adapter_model", safe_serialization=False
+        )
+        bin_errors(path / adapter)
+    return [
+        f"base_model={base}",
+        f"global_adapter={path / 'global'}",
+        f"local_adapter={path / 'local'}",
+    ]
+
+
+def sklearn_prevalence(path: Path, texts):
+    import joblib
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    embeddings = path / "embeddings"
+    encoder(embeddings, texts)
+    rng = np.random.default_rng(0)
+    regression = HistGradientBoostingRegressor(max_iter=10).fit(
+        rng.random((100, HIDDEN_SIZE)), rng.random(100)
+    )
+    bin_errors(path / "regression")
+    joblib.dump(regression, path / "regression" / "regression_model.pkl")
+    return [
+        f"embedding_model_path={embeddings}",
+        f"sklearn_model_path={path / 'regression'}",
+    ]
+
+
+# module/backend -> function that builds the models in a directory and returns the
+# config values that point the backend at them
+BUILDERS = {
+    "entities/flair": flair_tagger,
+    "sentence_classification/flair": flair_classifier,
+    "text_classification/flair": flair_classifier,
+    "summarize/transformer_abstractive": summarizer,
+    "prevalence/global_local_adapter": adapter_prevalence,
+    "prevalence/global_sklearn": sklearn_prevalence,
+}
+
+
+def build(root: Path, case: str, texts):
+    """The config values for the tiny models of `case`, built once under `root`."""
+    path = root / case.replace("/", "_")
+    done = path / "overrides.json"
+    if not done.exists():
+        path.mkdir(parents=True, exist_ok=True)
+        done.write_text(json.dumps(BUILDERS[case](path, texts)))
+    return json.loads(done.read_text())
@@ -2,23 +2,102 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
+from simplerad.prevalence.base import smooth_bin_errors
+
+
+def chunks(labels, predictions, chunk_size):
+    # memory-mapped arrays are only read chunk by chunk
+    for start in range(0, labels.shape[0], chunk_size):
+        yield (
+            np.asarray(labels[start : start + chunk_size], dtype=float),
+            np.asarray(predictions[start : start + chunk_size], dtype=float),
+        )
+
+
+def bin_index(labels, num_bins):
+    # same bins as np.digitize on np.linspace(0, 1, num_bins + 1), but labels of
+    # exactly 1 are counted in the last bin instead of being dropped
+    edges = np.linspace(0, 1, num_bins + 1)
+    return np.clip(np.digitize(labels, edges) - 1, 0, num_bins - 1)
+
+
+def accumulate(labels, predictions, num_bins, chunk_size):
+    """Sum of absolute errors and number of samples per label bin."""
+    sums = np.zeros(num_bins)
+    counts = np.zeros(num_bins)
+    for y, p in chunks(labels, predictions, chunk_size):
+        bins = bin_index(y, num_bins)
+        sums += np.bincount(bins, weights=np.abs(y - p), minlength=num_bins)
+        counts += np.bincount(bins, minlength=num_bins)
+    return sums, counts
+
 
-def make_error_bins(labels, predictions, num_bins=100):
-    bin_errors = np.zeros(num_bins, dtype=float)
-    labels_discretized = np.digitize(labels, np.linspace(0, 1, num_bins + 1))
-    for i in range(1, num_bins + 1):
-        bin_errors[i - 1] = np.mean(
-            np.abs(
-                labels[labels_discretized == i] - predictions[labels_discretized == i]
+def bootstrap(path_labels, path_predictions, num_bins, chunk_size, replicates, seed):
+    # Poisson bootstrap: every sample is drawn Poisson(1) times per replicate, which
+    # approximates resampling with replacement and needs a single pass over the data
+    labels = np.load(path_labels, mmap_mode="r").reshape(-1)
+    predictions = np.load(path_predictions, mmap_mode="r").reshape(-1)
+    rng = np.random.default_rng(seed)
+    sums = np.zeros((replicates, num_bins))
+    counts = np.zeros((replicates, num_bins))
+    for y, p in chunks(labels, predictions, chunk_size):
+        bins = bin_index(y, num_bins)
+        errors = np.abs(y - p)
+        for r in range(replicates):
+            weights = rng.poisson(1, size=len(y))
+            sums[r] += np.bincount(bins, weights=weights * errors, minlength=num_bins)
+            counts[r] += np.bincount(bins, weights=weights, minlength=num_bins)
+    return sums, counts
+
+
+def mean_errors(sums, counts):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bin_errors = sums / counts
+    # replace nan values (empty bins) with the mean error value
+    mean = np.nanmean(bin_errors, axis=-1, keepdims=True)
+    return np.where(np.isnan(bin_errors), mean, bin_errors)
+
+
+def normalize(sums, counts):
+    """Mean error per bin scaled to [0, 1], as used by calculate_confidence."""
+    bin_errors = mean_errors(sums, counts)
+    low, high = bin_errors.min(), bin_errors.max()
+    return (bin_errors - low) / (high - low), (low, high)
+
+
+def make_error_bins(labels, predictions, num_bins=100, chunk_size=1_000_000):
+    return normalize(*accumulate(labels, predictions, num_bins, chunk_size))[0]
+
+
+def confidence_intervals(args, workers, scale):
+    # replicates are split over processes, each streams the arrays once
+    seeds = np.random.SeedSequence(args.seed).spawn(workers)
+    sizes = [len(r) for r in np.array_split(np.arange(args.bootstrap), workers)]
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(
+            pool.map(
+                bootstrap,
+                [args.labels] * workers,
+                [args.predictions] * workers,
+                [args.num_bins] * workers,
+                [args.chunk_size] * workers,
+                sizes,
+                seeds,
             )
         )
-    # replace nan values with the mean error value
-    bin_errors[np.isnan(bin_errors)] = np.nanmean(bin_errors)
-    bin_errors = (bin_errors - bin_errors.min()) / (bin_errors.max() - bin_errors.min())
-    return bin_errors
+    sums = np.concatenate([s for s, _ in parts])
+    counts = np.concatenate([c for _, c in parts])
+    # on the scale of the point estimate, so the intervals bracket its table
+    low, high = scale
+    replicates = (mean_errors(sums, counts) - low) / (high - low)
+    alpha = (1 - args.confidence) / 2
+    return np.quantile(replicates, [alpha, 1 - alpha], axis=0)
 
 
 if __name__ == "__main__":
@@ -27,13 +106,50 @@ if __name__ == "__main__":
     p.add_argument("--predictions", type=Path, required=True)
     p.add_argument("--output_dir", type=Path, required=True)
     p.add_argument("--num_bins", type=int, default=100)
+    p.add_argument(
+        "--smooth",
+        type=int,
+        nargs="*",
+        default=[],
+        help="also write bin_errors_smooth<w>.npy for these smooth_error_window values",
+    )
+    p.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        help="bootstrap replicates for confidence intervals, 0 to skip",
+    )
+    p.add_argument("--confidence", type=float, default=0.95)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--workers", type=int, default=os.cpu_count())
+    p.add_argument("--chunk_size", type=int, default=1_000_000)
     args = p.parse_args()
 
-    print("Loading labels and predictions...")
-    labels = np.load(args.labels)
-    predictions = np.load(args.predictions)
+    print("Memory-mapping labels and predictions...")
+    labels = np.load(args.labels, mmap_mode="r").reshape(-1)
+    predictions = np.load(args.predictions, mmap_mode="r").reshape(-1)
+    if labels.shape != predictions.shape:
+        p.error(f"{labels.shape[0]} labels but {predictions.shape[0]} predictions")
+
     print(f"Calculating errors for {args.num_bins} bins...")
-    error_bins = make_error_bins(labels, predictions, num_bins=args.num_bins)
+    sums, counts = accumulate(labels, predictions, args.num_bins, args.chunk_size)
+    error_bins, scale = normalize(sums, counts)
+    print(f"{int((counts == 0).sum())} of {args.num_bins} bins are empty")
 
+    args.output_dir.mkdir(parents=True, exist_ok=True)
     print(f"Saving results to {args.output_dir}/bin_errors.npy")
     np.save(args.output_dir / "bin_errors.npy", error_bins)
+    np.save(args.output_dir / "bin_counts.npy", counts)
+    for window in args.smooth:
+        # loaded by the prevalence models for the same smooth_error_window
+        path = args.output_dir / f"bin_errors_smooth{window}.npy"
+        print(f"Saving errors smoothed over {window} bins to {path}")
+        np.save(path, smooth_bin_errors(error_bins, window))
+
+    if args.bootstrap > 0:
+        workers = max(1, min(args.workers, args.bootstrap))
+        print(f"Bootstrapping {args.bootstrap} replicates on {workers} workers...")
+        intervals = confidence_intervals(args, workers, scale)
+        path = args.output_dir / "bin_errors_ci.npy"
+        print(f"Saving {args.confidence:.0%} intervals (lower, upper) to {path}")
+        np.save(path, intervals)
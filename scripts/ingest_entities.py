@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Bulk version of add_entity.py: imports a terminology release (CSV or JSONL) into
+# an entity list directory in one pass. Records are validated, filled with the same
+# defaults as add_entity.py and deduplicated against everything already in the
+# directory, by source/source_id and by normalized title and synonyms.
+#
+# Like add_entity.py, records without a source get the source of the list they are
+# added to (an existing --shard). A new list is named after the input file, as in
+# add_entity.py, so its records get the input file name, e.g. radlex for radlex.csv.
+
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+from time import strftime
+
+from pydantic import ValidationError
+
+from simplerad.search.schemas import SearchResponse
+from simplerad.utils import text_key
+
+Entity = SearchResponse.SearchResult.Entity
+
+
+def normalize(name: str):
+    # searchers match case-insensitively, and whitespace is irrelevant
+    return " ".join(name.lower().split())
+
+
+class EntityIndex:
+    """Hashes of the ids and names of known entities, so dedup against large lists
+    costs a set lookup per record and 16 bytes per key."""
+
+    def __init__(self):
+        self.ids = set()
+        self.names = set()
+
+    @staticmethod
+    def id_key(entity):
+        return text_key(f"{entity['source']}:{entity['source_id']}")
+
+    @staticmethod
+    def name_keys(entity):
+        names = [entity["title"], *entity.get("synonyms", [])]
+        return {text_key(normalize(name)) for name in names}
+
+    def add(self, entity):
+        self.ids.add(self.id_key(entity))
+        self.names.update(self.name_keys(entity))
+
+    def duplicate(self, entity, check_names=True):
+        if self.id_key(entity) in self.ids:
+            return "duplicate id"
+        if check_names and not self.name_keys(entity).isdisjoint(self.names):
+            return "duplicate name"
+        return None
+
+
+def iter_jsonl(fname):
+    with open(fname) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(fname, synonym_separator):
+    with open(fname, newline="") as f:
+        for row in csv.DictReader(f):
+            row = {k: v for k, v in row.items() if v not in (None, "")}
+            if "synonyms" in row:
+                row["synonyms"] = [
+                    s.strip() for s in row["synonyms"].split(synonym_separator)
+                ]
+            yield row
+
+
+def read_records(fname, synonym_separator):
+    if fname.suffix == ".csv":
+        return read_csv(fname, synonym_separator)
+    return iter_jsonl(fname)
+
+
+def list_source(path: Path):
+    # source of the first entity of an existing list, as add_entity.py uses
+    if path.exists():
+        for entity in iter_jsonl(path):
+            return entity.get("source")
+    return None
+
+
+def fill_defaults(record, source):
+    # same defaults as add_entity.py
+    record = dict(record)
+    if not record.get("description"):
+        record["description"] = "geen omschrijving beschikbaar"
+    if not record.get("url"):
+        record["url"] = ""
+    if not record.get("source"):
+        record["source"] = source
+    if not record.get("source_id") and record.get("title"):
+        record["source_id"] = record["title"].lower()
+    return record
+
+
+def validate(record):
+    entity = Entity.parse_obj(record)
+    synonyms = record.get("synonyms", [])
+    if not isinstance(synonyms, list) or not all(isinstance(s, str) for s in synonyms):
+        raise ValueError("synonyms must be a list of strings")
+    # the fields of the schema plus synonyms, which the searchers use as well
+    return {**entity.dict(), **({"synonyms": synonyms} if synonyms else {})}
+
+
+def build_index(entity_dir: Path):
+    index = EntityIndex()
+    for fname in sorted(entity_dir.glob("*.jsonl")):
+        for entity in iter_jsonl(fname):
+            index.add(entity)
+    return index
+
+
+def write_shard(path: Path, entities, append: bool):
+    lines = "".join(json.dumps(e) + "\n" for e in entities)
+    if append:
+        # a single append write, the existing lines are not touched
+        with open(path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        return
+    # the new version is complete before it replaces the shard; the temporary name
+    # does not end in .jsonl, so searchers never load it
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as out:
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    out.write(line)
+        out.write(lines)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("entity_dir", type=Path, help="jsonl_directory of the searchers")
+    p.add_argument("inputs", type=Path, nargs="+", help="CSV or JSONL files")
+    p.add_argument(
+        "--shard",
+        help="file name in entity_dir to add to (default: <source>-<timestamp>.jsonl)",
+    )
+    p.add_argument(
+        "--source",
+        help="source of records without one (default: the source of --shard if it "
+        "exists, else the input file name)",
+    )
+    p.add_argument("--synonym_separator", default="|", help="for CSV input")
+    p.add_argument(
+        "--append",
+        action="store_true",
+        help="append to an existing shard in place instead of atomically replacing it",
+    )
+    p.add_argument(
+        "--keep_duplicate_names",
+        action="store_true",
+        help="only skip records whose source/source_id already exists",
+    )
+    p.add_argument("--rejected", type=Path, help="write skipped records here")
+    p.add_argument("--dry_run", action="store_true")
+    args = p.parse_args()
+
+    args.entity_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Indexing existing entities in {args.entity_dir}...")
+    index = build_index(args.entity_dir)
+    print(f"{len(index.ids)} entities, {len(index.names)} names")
+
+    shard = (
+        args.shard
+        or f"{args.source or args.inputs[0].stem}-{strftime('%Y%m%d-%H%M%S')}.jsonl"
+    )
+    if not shard.endswith(".jsonl"):
+        shard += ".jsonl"
+    shard_source = list_source(args.entity_dir / shard)
+
+    added, rejected = [], []
+    for fname in args.inputs:
+        source = args.source or shard_source or fname.stem
+        for i, record in enumerate(read_records(fname, args.synonym_separator), 1):
+            try:
+                entity = validate(fill_defaults(record, source))
+            except (ValidationError, ValueError) as e:
+                rejected.append(
+                    {
+                        "record": record,
+                        "reason": "invalid",
+                        "error": f"{fname}:{i}: {e}",
+                    }
+                )
+                continue
+            reason = index.duplicate(entity, not args.keep_duplicate_names)
+            if reason is not None:
+                rejected.append({"record": entity, "reason": reason})
+                continue
+            # also deduplicates within the input
+            index.add(entity)
+            added.append(entity)
+
+    reasons = Counter(r["reason"] for r in rejected)
+    print(f"{len(added)} new entities, skipped: {dict(reasons) or 'none'}")
+    if args.rejected:
+        with open(args.rejected, "w") as f:
+            for r in rejected:
+                print(json.dumps(r), file=f)
+
+    if args.dry_run or not added:
+        sys.exit(0)
+    print(f"Writing to {args.entity_dir / shard}")
+    write_shard(args.entity_dir / shard, added, args.append)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Admission control per endpoint. Requests wait for a slot of their endpoint and of
+# their lane; lanes split the worker threads, so a few slow /summarize/ calls cannot
+# take the threads of /search/. Async endpoints that make several thread calls per
+# request (/analyze/, /stream/*, /live/) run them with run_sync() on threads of
+# their own lane, not on the shared thread pool of the sync endpoints. Requests
+# that would wait too long are rejected with Retry-After instead of queueing
+# without bound:
+#   429 when the queue of the endpoint is full,
+#   503 when no slot became available within the queue timeout,
+#   413 when a request holds more items than the endpoint allows.
+
+import asyncio
+import math
+from contextvars import ContextVar
+from functools import partial, wraps
+from time import perf_counter
+from typing import Optional
+
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from omegaconf import DictConfig
+from starlette.routing import Match
+
+from . import metrics
+from .utils import finally_sent
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class EndpointLimit:
+    def __init__(
+        self,
+        endpoint: str,
+        max_concurrency: int,
+        max_queue: int,
+        queue_timeout: float,
+        max_items: int,
+        lane: Optional[str],
+    ):
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # negative values wait without bound
+        self.queue_timeout = queue_timeout if queue_timeout >= 0 else None
+        self.max_items = max_items
+        self.lane = lane
+        self.slots = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.waiting = 0
+        # moving average of the time requests hold a slot, for Retry-After
+        self.seconds = 0.0
+
+    def retry_after(self):
+        # rough time until the requests ahead in the queue are done
+        concurrency = max(self.max_concurrency, 1)
+        return max(1, math.ceil(self.seconds * (self.waiting + 1) / concurrency))
+
+    def done(self, seconds: float):
+        self.seconds = 0.9 * self.seconds + 0.1 * seconds if self.seconds else seconds
+
+
+class Ticket:
+    # the slots held by one admitted request
+    def __init__(self, limit: EndpointLimit, slots):
+        self.limit = limit
+        self.slots = slots
+        self.start = perf_counter()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        for slots in self.slots:
+            slots.release()
+        self.limit.done(perf_counter() - self.start)
+
+
+current_limit: ContextVar[Optional[EndpointLimit]] = ContextVar(
+    "current_limit", default=None
+)
+
+
+class Admission:
+    def __init__(self):
+        self.enabled = False
+        self.default = {}
+        self.endpoints = {}
+        self.limits = {}
+        self.lanes = {}
+        self.lane_sizes = {}
+        self.thread_limiters = {}
+
+    def set_config(self, config: DictConfig):
+        self.enabled = config["enabled"]
+        self.lane_sizes = dict(config["lanes"])
+        self.lanes = {
+            name: asyncio.Semaphore(size) for name, size in self.lane_sizes.items()
+        }
+        self.thread_limiters = {
+            name: anyio.CapacityLimiter(size) for name, size in self.lane_sizes.items()
+        }
+        self.default = dict(config["default"])
+        self.endpoints = {k: dict(v) for k, v in config["endpoints"].items()}
+        for endpoint, settings in [("default", self.default), *self.endpoints.items()]:
+            if settings.get("lane") is not None and settings["lane"] not in self.lanes:
+                raise ValueError(f"{endpoint} uses unknown lane {settings['lane']}")
+        self.limits = {}
+
+    def settings(self, path: str):
+        # exact route paths first, then the longest matching "<prefix>*"
+        if path in self.endpoints:
+            return {**self.default, **self.endpoints[path]}
+        prefixes = [
+            p for p in self.endpoints if p.endswith("*") and path.startswith(p[:-1])
+        ]
+        if prefixes:
+            return {**self.default, **self.endpoints[max(prefixes, key=len)]}
+        return self.default
+
+    def threads(self):
+        # worker threads needed to run every lane at full capacity
+        return sum(self.lane_sizes.values())
+
+    def thread_limiter(self, path: Optional[str] = None):
+        # of the lane of `path`, or else of the current request; None for the
+        # shared thread pool
+        if not self.enabled:
+            return None
+        limit = self.limit(path) if path is not None else current_limit.get()
+        if limit is None:
+            return None
+        return self.thread_limiters.get(limit.lane)
+
+    async def run_sync(self, fn, *args, path: Optional[str] = None):
+        """fn(*args) on a worker thread of the lane of `path` or of the current
+        request, so the thread calls of one request count against its lane."""
+        limiter = self.thread_limiter(path)
+        return await anyio.to_thread.run_sync(partial(fn, *args), limiter=limiter)
+
+    def limit(self, path: str):
+        if path not in self.limits:
+            self.limits[path] = EndpointLimit(path, **self.settings(path))
+        return self.limits[path]
+
+    @staticmethod
+    def match(app, scope):
+        for route in app.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def admit(self, limit: EndpointLimit):
+        """Wait for a slot of the endpoint and of its lane, or raise Rejected."""
+        lane = self.lanes.get(limit.lane)
+        busy = any(s is not None and s.locked() for s in (limit.slots, lane))
+        if busy and 0 <= limit.max_queue <= limit.waiting:
+            raise Rejected(429, "queue full", limit.retry_after())
+
+        start = perf_counter()
+        limit.waiting += 1
+        held = []
+        try:
+            # one deadline for both slots; the acquire runs in this task, so a
+            # timeout either cancels the wait or lets an acquired slot be recorded
+            with anyio.fail_after(limit.queue_timeout):
+                for slots in (limit.slots, lane):
+                    if slots is not None:
+                        await slots.acquire()
+                        held.append(slots)
+        except BaseException as e:
+            # also when the request is cancelled while it waits for the lane
+            for slots in held:
+                slots.release()
+            if isinstance(e, TimeoutError):
+                raise Rejected(503, "queue timeout", limit.retry_after()) from None
+            raise
+        finally:
+            limit.waiting -= 1
+            metrics.ADMISSION_WAIT_SECONDS.labels(limit.endpoint).observe(
+                perf_counter() - start
+            )
+        return Ticket(limit, held)
+
+    async def dispatch(self, request, call_next):
+        # http middleware, the slots are held until the response body is sent
+        route = self.match(request.app, request.scope) if self.enabled else None
+        if route is None:
+            return await call_next(request)
+        # so rejected requests are counted under their endpoint as well
+        request.scope["route"] = route
+        limit = self.limit(route.path)
+        try:
+            ticket = await self.admit(limit)
+        except Rejected as e:
+            metrics.ADMISSION_REJECTED.labels(limit.endpoint, e.reason).inc()
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"detail": f"server busy ({e.reason}), retry later"},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+        current_limit.set(limit)
+        try:
+            response = await call_next(request)
+        except BaseException:
+            ticket.release()
+            raise
+        # released when the body is sent, or sending fails before it started
+        return finally_sent(response, ticket.release)
+
+    def check_items(self, items: int):
+        limit = current_limit.get()
+        if limit is not None and limit.max_items >= 0 and items > limit.max_items:
+            metrics.ADMISSION_REJECTED.labels(limit.endpoint, "too many items").inc()
+            raise HTTPException(
+                status_code=413,
+                detail=f"at most {limit.max_items} items per request",
+            )
+
+    def limit_items(self, fn):
+        """Reject requests with more items than the endpoint allows with 413."""
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            req = kwargs.get("req")
+            if isinstance(req, list):
+                self.check_items(len(req))
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+
+admission = Admission()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Offline processing of a directory of reports with the same config groups and
+# backends as the server, e.g.
+#
+#   simplerad-batch batch.input_dir=reports/ batch.output_dir=out/ \
+#       'batch.modules=[entities,prevalence]' entities=flair
+#
+# The reports are split into shards. Worker processes load the models once and run
+# them on micro-batches, each shard is written to its own output file. Finished
+# shards are recorded in a manifest, so a killed run continues where it stopped
+# when started again with the same arguments and unchanged input files.
+
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+from .classification import (
+    classify_sentences_batch,
+    classify_text_batch,
+    sentence_classifiers,
+    text_classifiers,
+)
+from .entities import entity_taggers, tag_entities_batch
+from .pipeline import add_prevalence
+from .prevalence import prevalencers
+from .summarization import summarize_batch, summarizers
+from .utils import preprocess, preprocess_cache
+
+log = logging.getLogger(__name__)
+
+# module -> (function on a list of preprocessed texts, key in its results, field)
+MODULES = {
+    "entities": (tag_entities_batch, "spans", "spans"),
+    "sentence_classification": (classify_sentences_batch, "labels", "sentence_labels"),
+    "text_classification": (classify_text_batch, "labels", "text_labels"),
+    "summarize": (summarize_batch, "summary", "summary"),
+}
+
+registries = {
+    "entities": entity_taggers,
+    "prevalence": prevalencers,
+    "sentence_classification": sentence_classifiers,
+    "text_classification": text_classifiers,
+    "summarize": summarizers,
+}
+
+
+def count_lines(path: Path, shard_size: int):
+    # number of lines, and the byte offset of every shard_size-th line so workers
+    # can seek to their part of the file
+    offsets = []
+    n = 0
+    with open(path, "rb") as f:
+        while True:
+            if n % shard_size == 0:
+                offsets.append(f.tell())
+            if not f.readline():
+                break
+            n += 1
+    return n, offsets
+
+
+def input_files(input_dir: Path, output_dir: Path):
+    """The report files in `input_dir`, except those of an output_dir inside it."""
+    output_dir = output_dir.resolve()
+    return [
+        path
+        for path in sorted(input_dir.rglob("*"))
+        if path.suffix in (".txt", ".jsonl")
+        and path.is_file()
+        and output_dir not in path.resolve().parents
+    ]
+
+
+def plan_shards(input_dir: Path, files, shard_size: int):
+    """Split the reports in `files` into shards of at most `shard_size` reports.
+
+    Reports are `.txt` files, or lines `{"text": ..., "id": ...}` of `.jsonl`
+    files. A shard is a list of (path relative to `input_dir`, byte offset, first
+    line, number of reports) parts. The plan only depends on the input files, so
+    it is the same when a run is resumed.
+    """
+    shards, parts, size = [], [], 0
+    for path in files:
+        rel = str(path.relative_to(input_dir))
+        if path.suffix == ".jsonl":
+            n, offsets = count_lines(path, shard_size)
+            # jsonl files are split at shard_size lines, so shards never start
+            # halfway such a block
+            for i, offset in enumerate(offsets):
+                count = min(shard_size, n - i * shard_size)
+                if count <= 0:
+                    continue
+                if size + count > shard_size:
+                    shards.append(parts)
+                    parts, size = [], 0
+                parts.append((rel, offset, i * shard_size, count))
+                size += count
+        else:
+            if size + 1 > shard_size:
+                shards.append(parts)
+                parts, size = [], 0
+            parts.append((rel, None, 0, 1))
+            size += 1
+    if parts:
+        shards.append(parts)
+    return shards
+
+
+def read_reports(input_dir: Path, parts):
+    for rel, offset, first, count in parts:
+        path = input_dir / rel
+        if offset is None:
+            yield rel, path.read_text()
+            continue
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for i, line in enumerate(islice(f, count), first + 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                # valid json is not always a report, e.g. 5 or [1]
+                if not isinstance(record, dict) or not isinstance(
+                    record.get("text"), str
+                ):
+                    log.warning(f"skipping invalid line {i} of {rel}")
+                    yield f"{rel}:{i}", None
+                    continue
+                yield record.get("id", f"{rel}:{i}"), record["text"]
+
+
+def init_worker(cfg: dict, modules):
+    # runs once per worker process, loading the models up front
+    cfg = OmegaConf.create(cfg)
+    preprocess_cache.resize(0)
+    for module in modules:
+        registries[module].set_config(cfg[module])
+        registries[module].get_model()
+
+
+def process_batch(reports, modules):
+    preprocessed = [preprocess(text) for _, text in reports]
+    records = [{"id": id, **p} for (id, _), p in zip(reports, preprocessed)]
+    for module, (fn, key, field) in MODULES.items():
+        if module not in modules:
+            continue
+        for record, result in zip(records, fn(preprocessed)):
+            record[field] = result[key]
+    if "prevalence" in modules:
+        for record, p in zip(records, preprocessed):
+            record["spans"] = add_prevalence(record["spans"], p, {}, {})
+    return records
+
+
+def process_micro_batch(reports, modules):
+    try:
+        return process_batch(reports, modules)
+    except Exception as e:
+        if len(reports) == 1:
+            log.exception(f"failed on report {reports[0][0]}")
+            return [{"id": reports[0][0], "error": f"{type(e).__name__}: {e}"}]
+    # find the report that fails, the others are still processed
+    return [r for report in reports for r in process_micro_batch([report], modules)]
+
+
+def write_shard(path: Path, records, output_format: str):
+    tmp = path.with_name(path.name + ".tmp")
+    if output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # error records lack the result columns, and results the error column
+        columns = dict.fromkeys(k for record in records for k in record)
+        table = pa.Table.from_pydict({k: [r.get(k) for r in records] for k in columns})
+        pq.write_table(table, tmp)
+    else:
+        with open(tmp, "w") as f:
+            for record in records:
+                print(json.dumps(record), file=f)
+    # the shard only appears once it is complete
+    os.replace(tmp, path)
+
+
+def process_shard(input_dir: str, parts, path: str, modules, batch_size: int, fmt):
+    start = perf_counter()
+    reports = read_reports(Path(input_dir), parts)
+    records = []
+    while batch := list(islice(reports, batch_size)):
+        valid = [(id, text) for id, text in batch if text is not None]
+        results = iter(process_micro_batch(valid, modules) if valid else [])
+        # one record per report, in the order of the input
+        records += [
+            next(results) if text is not None else {"id": id, "error": "invalid report"}
+            for id, text in batch
+        ]
+    write_shard(Path(path), records, fmt)
+    return {
+        "shard": Path(path).name,
+        "items": len(records),
+        "errors": sum("error" in r for r in records),
+        "seconds": perf_counter() - start,
+    }
+
+
+def read_manifest(path: Path):
+    if not path.exists():
+        return []
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line is incomplete if the run was killed while writing it
+                pass
+    return entries
+
+
+def run(cfg: DictConfig):
+    batch = cfg.batch
+    input_dir, output_dir = Path(batch.input_dir), Path(batch.output_dir)
+    modules = list(batch.modules)
+    unknown = set(modules) - set(registries)
+    if unknown:
+        raise ValueError(f"unknown modules {unknown}, choose from {list(registries)}")
+    if "prevalence" in modules and "entities" not in modules:
+        raise ValueError("prevalence is computed for entities, add the entities module")
+    if batch.format not in ("jsonl", "parquet"):
+        raise ValueError(f"unknown output format {batch.format}, use jsonl or parquet")
+
+    # everything that determines the output; a run only resumes if this matches,
+    # files that were added or changed would change the shards
+    files = input_files(input_dir, output_dir)
+    run_info = {
+        "input_dir": str(input_dir.resolve()),
+        "shard_size": batch.shard_size,
+        "format": batch.format,
+        "modules": modules,
+        "config": {m: OmegaConf.to_container(cfg[m], resolve=True) for m in modules},
+        "files": [
+            [str(path.relative_to(input_dir)), stat.st_size, stat.st_mtime_ns]
+            for path, stat in ((path, path.stat()) for path in files)
+        ],
+    }
+    output_dir.mkdir(parents=True, exist_ok=True)
+    run_path = output_dir / "run.json"
+    if run_path.exists():
+        previous = json.loads(run_path.read_text())
+        if previous.get("files") != run_info["files"]:
+            raise ValueError(
+                f"the input files changed since the run in {output_dir} started, "
+                "choose another batch.output_dir"
+            )
+        if previous != run_info:
+            raise ValueError(
+                f"{output_dir} holds the output of a run with other arguments, "
+                "choose another batch.output_dir"
+            )
+    else:
+        run_path.write_text(json.dumps(run_info, indent=2))
+
+    manifest_path = output_dir / "manifest.jsonl"
+    done = {
+        entry["shard"]
+        for entry in read_manifest(manifest_path)
+        if (output_dir / entry["shard"]).exists()
+    }
+    shards = plan_shards(input_dir, files, batch.shard_size)
+    todo = [
+        (parts, output_dir / f"part-{i:05d}.{batch.format}")
+        for i, parts in enumerate(shards)
+        if f"part-{i:05d}.{batch.format}" not in done
+    ]
+    log.info(f"{len(shards)} shards, {len(shards) - len(todo)} done before")
+    if not todo:
+        return
+
+    cfg_container = OmegaConf.to_container(cfg, resolve=True)
+    args = (modules, batch.batch_size, batch.format)
+    start = perf_counter()
+    items = 0
+    with open(manifest_path, "a") as manifest:
+
+        def finished(entry):
+            nonlocal items
+            # the parent is the only writer of the manifest
+            print(json.dumps(entry), file=manifest, flush=True)
+            os.fsync(manifest.fileno())
+            items += entry["items"]
+            log.info(
+                f"{entry['shard']}: {entry['items']} reports, {entry['errors']} "
+                f"errors ({items / (perf_counter() - start):.1f} reports/s overall)"
+            )
+
+        if batch.workers <= 0:
+            # in this process, e.g. to debug or to share a single GPU
+            init_worker(cfg_container, modules)
+            for parts, path in todo:
+                finished(process_shard(str(input_dir), parts, str(path), *args))
+            return
+
+        # spawned workers do not inherit the threads and CUDA state of this process
+        context = multiprocessing.get_context(batch.start_method)
+        with ProcessPoolExecutor(
+            batch.workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(cfg_container, modules),
+        ) as pool:
+            futures = [
+                pool.submit(process_shard, str(input_dir), parts, str(path), *args)
+                for parts, path in todo
+            ]
+            try:
+                for future in as_completed(futures):
+                    finished(future.result())
+            except BaseException:
+                # finished shards are in the manifest, do not wait for the rest
+                pool.shutdown(cancel_futures=True)
+                raise
+
+
+@hydra.main(version_base=None, config_path="conf", config_name="batch")
+def main(cfg: DictConfig):
+    run(cfg)
+
+
+if __name__ == "__main__":
+    main()
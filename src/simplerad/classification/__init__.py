@@ -1,38 +1,78 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from ..utils import LazyValueDict, preprocess
-from .sentence_classification import FlairSentenceClassifier
-from .text_classification import FlairTextClassifier
+from typing import List, Optional
 
-text_classifiers = LazyValueDict(
+from ..utils import ModelRegistry, preprocess
+
+text_classifiers = ModelRegistry(
+    "text_classification",
     {
-        "flair": FlairTextClassifier,
-    }
+        "flair": "simplerad.classification.text_classification.FlairTextClassifier",
+        "stub": "simplerad.stubs.StubTextClassifier",
+    },
 )
 
-sentence_classifiers = LazyValueDict(
+sentence_classifiers = ModelRegistry(
+    "sentence_classification",
     {
-        "flair": FlairSentenceClassifier,
-    }
+        "flair": "simplerad.classification.sentence_classification.FlairSentenceClassifier",
+        "stub": "simplerad.stubs.StubSentenceClassifier",
+    },
 )
 
 
-def get_sentence_classification(text: str):
-    preprocessed = preprocess(text)
-    labels = sentence_classifiers.get_model().predict(preprocessed)
+def get_sentence_classification(text: str, engine: Optional[str] = None):
+    return classify_sentences(preprocess(text), engine)
+
+
+def classify_sentences(preprocessed: dict, engine: Optional[str] = None):
+    with sentence_classifiers.use(engine) as model:
+        labels = model.predict(preprocessed)
     return {"labels": labels, "sentences": preprocessed["sentences"]}
 
 
-def get_text_classification(text: str):
-    preprocessed = preprocess(text)
-    label = text_classifiers.get_model().predict(preprocessed)
+def classify_sentences_batch(preprocessed: List[dict], engine: Optional[str] = None):
+    with sentence_classifiers.use(engine) as model:
+        labels = model.predict_batch(preprocessed)
+    return [
+        {"labels": l, "sentences": p["sentences"]} for p, l in zip(preprocessed, labels)
+    ]
+
+
+def compact_sentence_classification(result: dict):
+    return {
+        "sentences": [
+            {"start": s["start"], "end": s["end"]} for s in result["sentences"]
+        ],
+        "labels": result["labels"],
+    }
+
+
+def get_text_classification(text: str, engine: Optional[str] = None):
+    return classify_text(preprocess(text), engine)
+
+
+def classify_text(preprocessed: dict, engine: Optional[str] = None):
+    with text_classifiers.use(engine) as model:
+        label = model.predict(preprocessed)
     return {"labels": label}
 
 
+def classify_text_batch(preprocessed: List[dict], engine: Optional[str] = None):
+    with text_classifiers.use(engine) as model:
+        labels = model.predict_batch(preprocessed)
+    return [{"labels": l} for l in labels]
+
+
 __all__ = [
     text_classifiers,
     sentence_classifiers,
     get_sentence_classification,
     get_text_classification,
+    classify_sentences,
+    classify_text,
+    classify_sentences_batch,
+    classify_text_batch,
+    compact_sentence_classification,
 ]
@@ -8,7 +8,15 @@ class BaseTextClassifier:
     def predict(self, text):
         raise NotImplementedError("subclass needs to implement this function")
 
+    def predict_batch(self, texts):
+        # backends that can run inference on several texts at once override this
+        return [self.predict(text) for text in texts]
+
 
 class BaseSentenceClassifier:
     def predict(self, text):
         raise NotImplementedError("subclass needs to implement this function")
+
+    def predict_batch(self, texts):
+        # backends that can run inference on several texts at once override this
+        return [self.predict(text) for text in texts]
@@ -28,3 +28,12 @@ class SentenceClassificationResponse(BaseModel):
 
     # list of labels and probabilities for each sentence
     labels: List[List[Label]]
+
+
+class CompactSentenceClassificationResponse(BaseModel):
+    class Span(BaseModel):
+        start: int
+        end: int
+
+    sentences: List[Span]
+    labels: List[List[SentenceClassificationResponse.Label]]
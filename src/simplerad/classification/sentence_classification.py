@@ -9,17 +9,31 @@ from omegaconf import DictConfig
 
 
 class FlairSentenceClassifier(BaseSentenceClassifier):
+    concurrency = "replicas"
+
     def __init__(self, cfg: DictConfig):
         self.model = TextClassifier.load(cfg["model_name"])
 
     def predict(self, text):
-        s = [Sentence(x["text"]) for x in text["sentences"]]
-        self.model.predict(s, return_probabilities_for_all_classes=True)
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        # all sentences of all texts in one call, split per text afterwards
+        s = [Sentence(x["text"]) for text in texts for x in text["sentences"]]
+        if s:
+            self.model.predict(
+                s, mini_batch_size=len(s), return_probabilities_for_all_classes=True
+            )
 
-        return [
+        labels = [
             [
                 {"value": x.value, "score": x.score}
                 for x in sent.labels[0].data_point.labels
             ]
             for sent in s
         ]
+        result = []
+        for text in texts:
+            result.append(labels[: len(text["sentences"])])
+            labels = labels[len(text["sentences"]) :]
+        return result
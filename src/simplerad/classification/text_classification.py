@@ -9,12 +9,23 @@ from omegaconf import DictConfig
 
 
 class FlairTextClassifier(BaseTextClassifier):
+    concurrency = "replicas"
+
     def __init__(self, cfg: DictConfig):
         self.model = TextClassifier.load(cfg["model_name"])
 
     def predict(self, text):
-        s = Sentence(text["text"])
-        self.model.predict(s, return_probabilities_for_all_classes=True)
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        s = [Sentence(text["text"]) for text in texts]
+        self.model.predict(
+            s, mini_batch_size=len(s), return_probabilities_for_all_classes=True
+        )
         return [
-            {"value": x.value, "score": x.score} for x in s.labels[0].data_point.labels
+            [
+                {"value": x.value, "score": x.score}
+                for x in y.labels[0].data_point.labels
+            ]
+            for y in s
         ]
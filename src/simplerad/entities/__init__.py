@@ -1,23 +1,115 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from ..utils import LazyValueDict, preprocess
-from .fuzzy import SimstringPredictor
-from .neural import FlairPredictor
+from typing import List, Optional
 
-entity_taggers = LazyValueDict(
+from ..search import search_many, searchers
+from ..search.base import entity_id
+from ..utils import ModelRegistry, preprocess, to_original_span
+
+entity_taggers = ModelRegistry(
+    "entities",
     {
-        "flair": FlairPredictor,
-        "simstring": SimstringPredictor,
-    }
+        "flair": "simplerad.entities.neural.FlairPredictor",
+        "simstring": "simplerad.entities.fuzzy.SimstringPredictor",
+        "stub": "simplerad.stubs.StubPredictor",
+    },
 )
 
 
-def get_entities(text: str):
+def get_entities(text: str, engine: Optional[str] = None):
+    return tag_entities(preprocess(text), engine)
+
+
+def tag_entities(preprocessed: dict, engine: Optional[str] = None):
+    with entity_taggers.use(engine) as model:
+        spans = model.predict(preprocessed)
+    return {**preprocessed, "spans": spans}
+
+
+def tag_entities_batch(preprocessed: List[dict], engine: Optional[str] = None):
+    with entity_taggers.use(engine) as model:
+        spans = model.predict_batch(preprocessed)
+    return [{**p, "spans": s} for p, s in zip(preprocessed, spans)]
+
+
+def get_linked_entities(
+    text: str,
+    k: int,
+    engine: Optional[str] = None,
+    search_engine: Optional[str] = None,
+    registry: Optional[ModelRegistry] = None,
+):
+    """Tagged spans with their top `k` catalog entities as "candidates".
+
+    The candidates come from the tagger's own matches if it has them, so no
+    searches are repeated; otherwise, or when a `search_engine` or a search
+    `registry` other than the configured one is asked for, the unique span texts
+    are searched in a single call to the searcher.
+    """
     preprocessed = preprocess(text)
-    preprocessed["spans"] = entity_taggers.get_model().predict(preprocessed)
+    search = search_engine or (registry is not None and registry is not searchers)
+    with entity_taggers.use(engine) as model:
+        spans = None if search else model.predict_linked(preprocessed, k)
+        if spans is None:
+            spans = model.predict(preprocessed)
+    if search or any("candidates" not in s for s in spans):
+        spans = link_spans(spans, k, search_engine, registry)
+    return {**preprocessed, "spans": spans}
+
+
+def link_spans(
+    spans: List[dict],
+    k: int,
+    engine: Optional[str] = None,
+    registry: Optional[ModelRegistry] = None,
+):
+    texts = list(dict.fromkeys(s["text"] for s in spans))
+    results = dict(zip(texts, search_many(texts, engine, registry)))
+    return [{**s, "candidates": results[s["text"]]["data"][:k]} for s in spans]
+
+
+def add_original_offsets(text: str, result: dict):
+    """`result` for `text` with the offsets of its sentences and spans in `text` as
+    it was sent, before whitespace was collapsed, as original_start/original_end."""
+
+    def add(span):
+        start, end = to_original_span(text, span["start"], span["end"])
+        return {**span, "original_start": start, "original_end": end}
+
+    return {
+        **result,
+        "sentences": [add(s) for s in result["sentences"]],
+        "spans": [add(s) for s in result["spans"]],
+    }
+
+
+def compact_entities(result: dict):
+    return {
+        "sentences": [compact_span(s) for s in result["sentences"]],
+        "spans": [compact_span(s) for s in result["spans"]],
+    }
+
 
-    return preprocessed
+def compact_span(span: dict):
+    compact = {"start": span["start"], "end": span["end"]}
+    if "original_start" in span:
+        compact["original_start"] = span["original_start"]
+        compact["original_end"] = span["original_end"]
+    if "candidates" in span:
+        compact["candidates"] = [
+            {"id": entity_id(c["entity"]), "score": c["score"]}
+            for c in span["candidates"]
+        ]
+    return compact
 
 
-__all__ = [entity_taggers, get_entities]
+__all__ = [
+    entity_taggers,
+    get_entities,
+    tag_entities,
+    tag_entities_batch,
+    get_linked_entities,
+    add_original_offsets,
+    compact_entities,
+]
@@ -5,3 +5,12 @@
 class BasePredictor:
     def predict(self, text):
         raise NotImplementedError("subclass needs to implement this function")
+
+    def predict_batch(self, texts):
+        # backends that can run inference on several texts at once override this
+        return [self.predict(text) for text in texts]
+
+    def predict_linked(self, text, k: int):
+        # taggers that find catalog entities themselves return the spans with their
+        # top k {"score", "entity"} candidates, others leave linking to a searcher
+        return None
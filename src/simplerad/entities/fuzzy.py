@@ -1,7 +1,6 @@
 from pathlib import Path
 from typing import Set, Tuple
 
-import spacy
 from hydra import compose
 from omegaconf import DictConfig
 from simstring.database.dict import DictDatabase
@@ -9,13 +8,18 @@ from simstring.feature_extractor.character_ngram import CharacterNgramFeatureExt
 from simstring.measure.cosine import CosineMeasure
 from simstring.searcher import Searcher
 
+from ..resources import resources
+from ..search import public_entity
 from ..utils import read_jsonl
 from .base import BasePredictor
 
 
 class SimstringPredictor(BasePredictor):
+    concurrency = "reentrant"
+
     def __init__(self, cfg: DictConfig):
-        self.nlp = spacy.load(cfg["spacy_model"], disable=["tagger", "parser"])
+        # only the tokenizer: stop words and punctuation are lexical attributes
+        self.nlp = resources.spacy(cfg["spacy_model"])
 
         self.known_entities = []
         data_path = Path(cfg["jsonl_directory"])
@@ -28,15 +32,44 @@ class SimstringPredictor(BasePredictor):
                 self.blacklisted.append(line.strip().lower())
 
         self.db = DictDatabase(CharacterNgramFeatureExtractor(cfg["char_ngram"]))
+        self.title2entity = {}
         for ent in self.known_entities:
             self.db.add(ent["title"].lower())
+            self.title2entity[ent["title"].lower()] = ent
             for s in ent.get("synonyms", []):
                 self.db.add(s.lower())
+                self.title2entity[s.lower()] = ent
         self.searcher = Searcher(self.db, CosineMeasure())
         self.cosim_threshold = cfg["cosim_threshold"]
         self.word_ngram = cfg["word_ngram"]
 
     def predict(self, text):
+        return [
+            # the linked candidates are only returned by predict_linked
+            {k: match[k] for k in ["start", "end", "text"]}
+            for match in self.match(text)
+        ]
+
+    def predict_linked(self, text, k: int):
+        # the candidates the tagger found anyway, best first and one per entity
+        spans = []
+        for match in self.match(text):
+            candidates = []
+            seen = set()
+            for score, name in match["matches"]:
+                entity = self.title2entity[name]
+                if entity["title"] not in seen and len(candidates) < k:
+                    candidates.append({"score": score, "entity": public_entity(entity)})
+                    seen.add(entity["title"])
+            spans.append(
+                {
+                    **{key: match[key] for key in ["start", "end", "text"]},
+                    "candidates": candidates,
+                }
+            )
+        return spans
+
+    def match(self, text):
         matches = []
         for sent in text["sentences"]:
             sent_start = sent["start"]
@@ -59,12 +92,7 @@ class SimstringPredictor(BasePredictor):
                             ),
                         }
                     )
-        filtered_matches = self.select_best_non_overlapping(matches)
-        return [
-            # do not return linked entities, that is for search.py
-            {k: match[k] for k in ["start", "end", "text"]}
-            for match in filtered_matches
-        ]
+        return self.select_best_non_overlapping(matches)
 
     def make_ngrams(self, text, n, min_length=3):
         def token_allowed(tok):
@@ -8,6 +8,8 @@ from .base import BasePredictor
 
 class FlairPredictor(BasePredictor):
     # small wrapper around Flair entity tagger
+    # one call per instance at a time, replicas share the tagger weights
+    concurrency = "replicas"
 
     def __init__(self, cfg: DictConfig):
         self.model = SequenceTagger.load(cfg["model_name"])
@@ -15,7 +17,14 @@ class FlairPredictor(BasePredictor):
     def predict(self, text):
         s = Sentence(text["text"])
         self.model.predict(s)
+        return self.spans(s)
 
+    def predict_batch(self, texts):
+        s = [Sentence(text["text"]) for text in texts]
+        self.model.predict(s, mini_batch_size=len(s))
+        return [self.spans(x) for x in s]
+
+    def spans(self, s: Sentence):
         return [
             {
                 "start": (start := x.start_position),
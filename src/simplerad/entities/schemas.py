@@ -1,17 +1,52 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
+from ..search.schemas import CompactSearchResponse, SearchResponse
+
 
 class EntityTaggerResponse(BaseModel):
     class Span(BaseModel):
         start: int
         end: int
         text: str
+        # offsets in the text as it was sent, with original_offsets=true
+        original_start: Optional[int] = None
+        original_end: Optional[int] = None
 
     text: str
     sentences: List[Span]
     spans: List[Span]
+
+
+class LinkedEntityTaggerResponse(BaseModel):
+    class Span(EntityTaggerResponse.Span):
+        # best matching catalog entities, as returned by /search/
+        candidates: List[SearchResponse.SearchResult]
+
+    text: str
+    sentences: List[EntityTaggerResponse.Span]
+    spans: List[Span]
+
+
+class CompactEntityTaggerResponse(BaseModel):
+    # offsets into the preprocessed text, and the sent text with original_offsets
+    class Span(BaseModel):
+        start: int
+        end: int
+        original_start: Optional[int] = None
+        original_end: Optional[int] = None
+
+    sentences: List[Span]
+    spans: List[Span]
+
+
+class CompactLinkedEntityTaggerResponse(BaseModel):
+    class Span(CompactEntityTaggerResponse.Span):
+        candidates: List[CompactSearchResponse.SearchResult]
+
+    sentences: List[CompactEntityTaggerResponse.Span]
+    spans: List[Span]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Incremental analysis of reports that are edited and sent again and again. The
+# client names the report with a document id and a revision. The results of the
+# last revision are kept per sentence, and only the sentences that are not in it
+# run through the models; the others are reused, their offsets shifted to the new
+# position of the sentence. The cost of a request then depends on the size of the
+# edit instead of the size of the report.
+
+from typing import Dict, List, NamedTuple, Optional
+
+from omegaconf import DictConfig
+
+from . import metrics
+from .classification import (
+    classify_sentences_batch,
+    classify_text_batch,
+    sentence_classifiers,
+    text_classifiers,
+)
+from .entities import entity_taggers, tag_entities_batch
+from .utils import LRUCache, text_key
+
+
+class Session(NamedTuple):
+    revision: int
+    # text_key of a sentence -> its result
+    results: Dict[bytes, object]
+
+
+def single_sentence(text: str):
+    # a sentence as a preprocessed report of its own
+    return {"text": text, "sentences": [{"start": 0, "end": len(text), "text": text}]}
+
+
+class Sessions:
+    def __init__(self):
+        self.cache = LRUCache("sessions", 1024)
+
+    def set_config(self, config: DictConfig):
+        self.cache.clear()
+        self.cache.resize(config["max_documents"])
+
+    def results(
+        self,
+        module: str,
+        engine: str,
+        document_id: str,
+        revision: int,
+        units: List[str],
+        infer,
+    ):
+        """`infer(texts)` for every text in `units`, reusing the results of the
+        previous revision of the document for texts that did not change."""
+        key = (module, engine, document_id)
+        session = self.cache.get(key)
+        known = session.results if session is not None else {}
+        keys = [text_key(unit) for unit in units]
+        results = {k: known[k] for k in keys if k in known}
+        missing = {k: unit for k, unit in zip(keys, units) if k not in results}
+        if missing:
+            results.update(zip(missing, infer(list(missing.values()))))
+        metrics.INCREMENTAL_UNITS.labels(module, "reused").inc(len(keys) - len(missing))
+        metrics.INCREMENTAL_UNITS.labels(module, "inferred").inc(len(missing))
+        # requests that arrive out of order do not replace a later revision
+        if session is None or revision >= session.revision:
+            self.cache.put(key, Session(revision, results))
+        return [results[k] for k in keys]
+
+
+sessions = Sessions()
+
+
+def tag_entities_incremental(
+    preprocessed: dict, document_id: str, revision: int, engine: Optional[str] = None
+):
+    def infer(texts):
+        results = tag_entities_batch([single_sentence(t) for t in texts], engine)
+        return [r["spans"] for r in results]
+
+    sentences = preprocessed["sentences"]
+    per_sentence = sessions.results(
+        "entities",
+        entity_taggers.resolve(engine),
+        document_id,
+        revision,
+        [s["text"] for s in sentences],
+        infer,
+    )
+    spans = [
+        {**span, "start": span["start"] + s["start"], "end": span["end"] + s["start"]}
+        for s, sentence_spans in zip(sentences, per_sentence)
+        for span in sentence_spans
+    ]
+    return {**preprocessed, "spans": spans}
+
+
+def classify_sentences_incremental(
+    preprocessed: dict, document_id: str, revision: int, engine: Optional[str] = None
+):
+    def infer(texts):
+        results = classify_sentences_batch([single_sentence(t) for t in texts], engine)
+        return [r["labels"][0] for r in results]
+
+    labels = sessions.results(
+        "sentence_classification",
+        sentence_classifiers.resolve(engine),
+        document_id,
+        revision,
+        [s["text"] for s in preprocessed["sentences"]],
+        infer,
+    )
+    return {"labels": labels, "sentences": preprocessed["sentences"]}
+
+
+def classify_text_incremental(
+    preprocessed: dict, document_id: str, revision: int, engine: Optional[str] = None
+):
+    # the labels depend on the whole text, they are only reused if nothing changed
+    def infer(texts):
+        return [r["labels"] for r in classify_text_batch([preprocessed], engine)]
+
+    (labels,) = sessions.results(
+        "text_classification",
+        text_classifiers.resolve(engine),
+        document_id,
+        revision,
+        [preprocessed["text"]],
+        infer,
+    )
+    return {"labels": labels}
+
+
+__all__ = [
+    sessions,
+    tag_entities_incremental,
+    classify_sentences_incremental,
+    classify_text_incremental,
+]
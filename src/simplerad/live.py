@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Live analysis over a WebSocket, for editors that analyze a report while it is
+# typed. The client sends every edit as an AnalyzeRequest (the full text, with an
+# increasing revision). Edits that follow each other within `debounce` seconds are
+# coalesced into the last one, analyzed at least every `max_delay` seconds while
+# edits keep coming. One analysis runs at a time, the newest edit waits for it. A
+# newer edit supersedes the running analysis: it stops before its next model call
+# (the running one cannot be interrupted) and sends no more results. Analyses
+# forced by `max_delay` are not superseded, so results arrive while the client
+# keeps typing. Results are sent per module as soon as it finishes:
+#
+#   {"revision": 7, "module": "preprocess", "result": {"text": ..., "sentences": ...}}
+#   {"revision": 7, "module": "entities", "result": [spans]}
+#   {"revision": 7, "module": "prevalence", "result": [spans with prevalence]}
+#   {"revision": 7, "module": "text_classification", "result": [labels]}
+#   {"revision": 7, "module": "summarize", "error": "..."}
+#   {"revision": 7, "done": true, "timings": {...}}
+#
+# An analysis that fails as a whole ends with {"revision": 7, "done": true,
+# "error": "..."}, the session goes on with the next edit.
+#
+# Offsets refer to the preprocessed text. Unchanged sentences are not analyzed
+# again, see incremental.py.
+
+import asyncio
+import logging
+import threading
+from time import perf_counter
+from uuid import uuid4
+
+import orjson
+from omegaconf import DictConfig
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from . import metrics
+from .admission import admission
+from .pipeline import MODULES, add_prevalence, run_module
+from .schemas import AnalyzeRequest
+from .utils import preprocess
+
+logger = logging.getLogger("uvicorn")
+
+
+class Superseded(Exception):
+    pass
+
+
+class Live:
+    def __init__(self):
+        self.debounce = 0.15
+        self.max_delay = 1.0
+
+    def set_config(self, config: DictConfig):
+        self.debounce = config["debounce"]
+        self.max_delay = config["max_delay"]
+
+    async def analyze(
+        self,
+        send,
+        edit: AnalyzeRequest,
+        document_id: str,
+        superseded: threading.Event,
+    ):
+        async def reply(message):
+            if superseded.is_set():
+                raise Superseded()
+            await send({"revision": edit.revision, **message})
+
+        async def call(fn, *args):
+            if superseded.is_set():
+                raise Superseded()
+            # on the threads of the lane of /live/
+            return await admission.run_sync(fn, *args, path="/live/")
+
+        start = perf_counter()
+        timings = {}
+        document = (document_id, edit.revision)
+
+        async def run(module):
+            try:
+                result = await call(
+                    run_module, module, preprocessed, edit.engines, timings, document
+                )
+                await reply({"module": module, "result": result})
+                if module == "entities" and "prevalence" in edit.modules:
+                    module = "prevalence"
+                    result = await call(
+                        add_prevalence,
+                        result,
+                        preprocessed,
+                        edit.engines,
+                        timings,
+                        superseded,
+                    )
+                    await reply({"module": module, "result": result})
+            except Superseded:
+                # the other modules stop at their next call as well
+                return
+            except Exception as e:
+                logger.exception(f"live analysis failed in {module}")
+                await reply({"module": module, "error": f"{type(e).__name__}: {e}"})
+
+        try:
+            preprocessed = await call(preprocess, edit.text)
+            timings["preprocess"] = perf_counter() - start
+            await reply({"module": "preprocess", "result": preprocessed})
+            await asyncio.gather(*(run(m) for m in MODULES if m in edit.modules))
+            timings["total"] = perf_counter() - start
+            await reply({"done": True, "timings": timings})
+        except Superseded:
+            pass
+
+    async def session(self, websocket: WebSocket):
+        await websocket.accept()
+        # edits without a document_id are one document per connection
+        connection_id = uuid4().hex
+        lock = asyncio.Lock()
+
+        async def send(message):
+            async with lock:
+                await websocket.send_text(orjson.dumps(message).decode())
+
+        pending = None  # newest edit that is not analyzed yet
+        first_pending = 0.0
+        forced = False  # the pending edit is due because of max_delay
+        timer = None  # until the pending edit is due
+        analysis = None
+        analyzed = None  # the edit of the running analysis
+        superseded = None  # set to stop the running analysis, None if it is forced
+
+        def start():
+            nonlocal pending, analysis, analyzed, superseded
+            document_id = pending.document_id or connection_id
+            stop = threading.Event()
+            analysis = asyncio.create_task(
+                self.analyze(send, pending, document_id, stop)
+            )
+            analyzed, pending = pending, None
+            superseded = None if forced else stop
+            metrics.LIVE_EDITS.labels("analyzed").inc()
+
+        receiving = asyncio.create_task(websocket.receive_text())
+        try:
+            while True:
+                tasks = {t for t in (receiving, timer, analysis) if t is not None}
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+                if receiving in done:
+                    message = receiving.result()
+                    receiving = asyncio.create_task(websocket.receive_text())
+                    try:
+                        edit = AnalyzeRequest.parse_raw(message)
+                    except ValidationError as e:
+                        await send({"error": str(e)})
+                        continue
+                    if superseded is not None and not superseded.is_set():
+                        # its results are out of date before they are complete
+                        superseded.set()
+                        metrics.LIVE_EDITS.labels("cancelled").inc()
+                    if pending is not None:
+                        metrics.LIVE_EDITS.labels("coalesced").inc()
+                    else:
+                        first_pending = perf_counter()
+                    pending = edit
+                    if timer is not None:
+                        timer.cancel()
+                    # wait for a pause in the edits, but not longer than max_delay
+                    left = first_pending + self.max_delay - perf_counter()
+                    forced = left < self.debounce
+                    delay = min(self.debounce, left)
+                    timer = asyncio.create_task(asyncio.sleep(max(delay, 0)))
+
+                elif timer in done:
+                    timer = None
+                    # otherwise the edit is due when the running analysis ends
+                    if analysis is None:
+                        start()
+
+                elif analysis in done:
+                    error = analysis.exception()
+                    analysis = superseded = None
+                    if isinstance(error, WebSocketDisconnect):
+                        raise error
+                    if error is not None:
+                        logger.error(
+                            "live analysis failed",
+                            exc_info=(type(error), error, error.__traceback__),
+                        )
+                        await send(
+                            {
+                                "revision": analyzed.revision,
+                                "done": True,
+                                "error": f"{type(error).__name__}: {error}",
+                            }
+                        )
+                    if pending is not None and timer is None:
+                        start()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in (receiving, timer, analysis):
+                if task is not None:
+                    task.cancel()
+
+
+live = Live()
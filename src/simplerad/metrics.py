@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+REQUEST_SECONDS = Histogram(
+    "simplerad_request_seconds", "Request latency per endpoint", ["endpoint"]
+)
+STAGE_SECONDS = Histogram(
+    "simplerad_stage_seconds",
+    "Time per request spent in preprocess, inference, ranking and serialization",
+    ["endpoint", "stage"],
+)
+REQUEST_ITEMS = Histogram(
+    "simplerad_request_items",
+    "Number of items per request",
+    ["endpoint"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000),
+)
+STREAM_ITEMS = Counter(
+    "simplerad_stream_items_total",
+    "Items processed by the streaming endpoints",
+    ["endpoint"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "simplerad_admission_wait_seconds",
+    "Time requests wait for a slot of their endpoint and lane",
+    ["endpoint"],
+)
+ADMISSION_REJECTED = Counter(
+    "simplerad_admission_rejected_total",
+    "Requests rejected by admission control",
+    ["endpoint", "reason"],
+)
+SEARCH_SHARD_SECONDS = Histogram(
+    "simplerad_search_shard_seconds",
+    "Latency of the shards of the distributed searcher",
+    ["shard"],
+)
+SEARCH_SHARD_FAILURES = Counter(
+    "simplerad_search_shard_failures_total",
+    "Shards left out of distributed search results",
+    ["shard", "reason"],
+)
+INCREMENTAL_UNITS = Counter(
+    "simplerad_incremental_units_total",
+    "Sentences (texts for text classification) of requests with a document id, "
+    "reused from the previous revision or inferred",
+    ["module", "result"],
+)
+LIVE_EDITS = Counter(
+    "simplerad_live_edits_total",
+    "Edits received on /live/, analyzed, coalesced into a later edit, or whose "
+    "analysis was stopped by a later edit",
+    ["result"],
+)
+INFERENCE_SECONDS = Histogram(
+    "simplerad_inference_seconds", "Latency per model call", ["module", "backend"]
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "simplerad_model_load_seconds",
+    "Time to construct a model",
+    ["module", "backend"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+MODEL_MEMORY_BYTES = Gauge(
+    "simplerad_model_memory_bytes",
+    "Estimated memory of resident models",
+    ["module", "backend"],
+)
+CACHE_REQUESTS = Counter(
+    "simplerad_cache_requests_total", "Cache lookups", ["cache", "result"]
+)
+INFERENCE_IN_PROGRESS = Gauge(
+    "simplerad_inference_in_progress",
+    "Model calls currently running",
+    ["module", "backend"],
+)
+INFERENCE_QUEUE_DEPTH = Gauge(
+    "simplerad_inference_queue_depth",
+    "Model calls waiting for their model to become available",
+    ["module", "backend"],
+)
+
+
+class RequestStats:
+    # collects stage timings of one request, possibly from several threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = defaultdict(float)
+        self.items = None
+        self.returned = None
+        # set for requests that are profiled, see profiling.py
+        self.profile = None
+
+    def add(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] += seconds
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+@contextmanager
+def stage(name: str, detail: Optional[str] = None):
+    # outside of a request (e.g. scripts) this only costs a perf_counter call
+    stats = current_request.get()
+    profile = stats.profile if stats is not None else None
+    start = perf_counter()
+    try:
+        if profile is None:
+            yield
+        else:
+            with profile.attach():
+                yield
+    finally:
+        seconds = perf_counter() - start
+        if stats is not None:
+            stats.add(name, seconds)
+        if profile is not None:
+            profile.record(name, detail, seconds)
+
+
+def instrumented(fn):
+    """Record the number of items of an endpoint and the moment it returned, so the
+    time spent serializing its response can be measured afterwards."""
+
+    def record(kwargs):
+        stats = current_request.get()
+        if stats is not None:
+            req = kwargs.get("req")
+            if isinstance(req, list):
+                stats.items = len(req)
+            stats.returned = perf_counter()
+
+    if asyncio.iscoroutinefunction(fn):
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            result = await fn(*args, **kwargs)
+            record(kwargs)
+            return result
+
+    else:
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            stats = current_request.get()
+            if stats is not None and stats.profile is not None:
+                # sync endpoints run in a worker thread, sample it as a whole
+                with stats.profile.attach():
+                    result = fn(*args, **kwargs)
+            else:
+                result = fn(*args, **kwargs)
+            record(kwargs)
+            return result
+
+    return wrapper
+
+
+def start_request():
+    stats = RequestStats()
+    current_request.set(stats)
+    return stats
+
+
+def endpoint_name(scope):
+    # route template, so arbitrary URLs do not create new series
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+def observe_request(scope, stats: RequestStats, start: float):
+    end = perf_counter()
+    endpoint = endpoint_name(scope)
+
+    REQUEST_SECONDS.labels(endpoint).observe(end - start)
+    if stats.items is not None:
+        REQUEST_ITEMS.labels(endpoint).observe(stats.items)
+    if stats.returned is not None:
+        stats.add("serialization", end - stats.returned)
+        if stats.profile is not None:
+            stats.profile.record("serialization", None, end - stats.returned)
+    for name, seconds in stats.stages.items():
+        STAGE_SECONDS.labels(endpoint, name).observe(seconds)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from .admission import admission
+from .classification import classify_sentences, classify_text
+from .entities import tag_entities
+from .incremental import (
+    classify_sentences_incremental,
+    classify_text_incremental,
+    tag_entities_incremental,
+)
+from .prevalence import predict_global_prevalence, predict_local_prevalence
+from .summarization import summarize_text
+from .utils import preprocess
+
+# module -> (function on preprocessed text, key in its result, response field)
+MODULES = {
+    "entities": (tag_entities, "spans", "spans"),
+    "sentence_classification": (classify_sentences, "labels", "sentence_labels"),
+    "text_classification": (classify_text, "labels", "text_labels"),
+    "summarize": (summarize_text, "summary", "summary"),
+}
+
+# modules that reuse the results of the previous revision of a document
+INCREMENTAL = {
+    "entities": tag_entities_incremental,
+    "sentence_classification": classify_sentences_incremental,
+    "text_classification": classify_text_incremental,
+}
+
+
+def run_module(module, preprocessed, engines, timings, document=None):
+    # document: (document_id, revision) of an edited report, or None
+    fn, key, _ = MODULES[module]
+    start = perf_counter()
+    if document is not None and module in INCREMENTAL:
+        result = INCREMENTAL[module](preprocessed, *document, engines.get(module))[key]
+    else:
+        result = fn(preprocessed, engines.get(module))[key]
+    timings[module] = perf_counter() - start
+    return result
+
+
+def add_prevalence(spans, preprocessed, engines, timings, stop=None):
+    # chain prevalence directly on the tagged spans, the report is the context; once
+    # the `stop` event is set the remaining spans are left out
+    engine = engines.get("prevalence")
+    start = perf_counter()
+    result = []
+    for span in spans:
+        if stop is not None and stop.is_set():
+            break
+        result.append(
+            {
+                **span,
+                "global_prevalence": predict_global_prevalence(span["text"], engine),
+                "local_prevalence": predict_local_prevalence(
+                    span["text"], preprocessed["text"], engine
+                ),
+            }
+        )
+    timings["prevalence"] = perf_counter() - start
+    return result
+
+
+def entities_with_prevalence(preprocessed, engines, timings, document=None):
+    spans = run_module("entities", preprocessed, engines, timings, document)
+    return add_prevalence(spans, preprocessed, engines, timings)
+
+
+async def analyze(
+    text: str,
+    modules: List[str],
+    engines: Dict[str, str],
+    document: Optional[Tuple[str, int]] = None,
+):
+    """Preprocess once and run the requested modules concurrently on the result."""
+    start = perf_counter()
+    timings = {}
+    preprocessed = await admission.run_sync(preprocess, text)
+    timings["preprocess"] = perf_counter() - start
+
+    tasks = {}
+    for module, (_, _, field) in MODULES.items():
+        if module == "entities" and "prevalence" in modules:
+            # prevalence needs the tagged spans, so it is chained onto the tagger
+            tasks[field] = admission.run_sync(
+                entities_with_prevalence, preprocessed, engines, timings, document
+            )
+        elif module in modules:
+            tasks[field] = admission.run_sync(
+                run_module, module, preprocessed, engines, timings, document
+            )
+
+    results = {field: None for _, _, field in MODULES.values()}
+    results.update(zip(tasks, await asyncio.gather(*tasks.values())))
+    timings["total"] = perf_counter() - start
+    return {**preprocessed, **results, "timings": timings}
@@ -1,41 +1,61 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from ..utils import LazyValueDict, preprocess
-from .sklearn_models import SKLearnPrevalence
-from .transformer_models import GlobalLocalAdapterPrevalence
+from typing import Optional
 
-prevalencers = LazyValueDict(
+from ..utils import ModelRegistry, preprocess
+
+prevalencers = ModelRegistry(
+    "prevalence",
     {
-        "global_sklearn": SKLearnPrevalence,
-        "global_local_adapter": GlobalLocalAdapterPrevalence,
-    }
+        "global_sklearn": "simplerad.prevalence.sklearn_models.SKLearnPrevalence",
+        "global_local_adapter": "simplerad.prevalence.transformer_models.GlobalLocalAdapterPrevalence",
+        "stub": "simplerad.stubs.StubPrevalence",
+    },
 )
 
 
-def get_global_prevalence(text: str):
-    preprocessed = preprocess(text)
-    prevalence, certainty = prevalencers.get_model().get_global_prevalence(
-        preprocessed["text"]
-    )
+def to_float(value):
+    # models return numpy scalars or single-element arrays
+    return float(value.item() if hasattr(value, "item") else value)
+
+
+def get_global_prevalence(text: str, engine: Optional[str] = None):
+    return predict_global_prevalence(preprocess(text)["text"], engine)
+
+
+def predict_global_prevalence(term: str, engine: Optional[str] = None):
+    # term is expected to be preprocessed already
+    with prevalencers.use(engine) as model:
+        prevalence, certainty = model.get_global_prevalence(term)
 
     return {
-        "prevalence": prevalence,
-        "certainty": certainty,
+        "prevalence": to_float(prevalence),
+        "certainty": to_float(certainty),
     }
 
 
-def get_local_prevalence(text: str, context: str):
-    preprocessed = preprocess(text)
-    preprocessed_context = preprocess(context)
-    prevalence, certainty = prevalencers.get_model().get_local_prevalence(
-        preprocessed["text"], preprocessed_context["text"]
+def get_local_prevalence(text: str, context: str, engine: Optional[str] = None):
+    return predict_local_prevalence(
+        preprocess(text)["text"], preprocess(context)["text"], engine
     )
 
+
+def predict_local_prevalence(term: str, context: str, engine: Optional[str] = None):
+    # term and context are expected to be preprocessed already
+    with prevalencers.use(engine) as model:
+        prevalence, certainty = model.get_local_prevalence(term, context)
+
     return {
-        "prevalence": prevalence,
-        "certainty": certainty,
+        "prevalence": to_float(prevalence),
+        "certainty": to_float(certainty),
     }
 
 
-__all__ = [prevalencers, get_global_prevalence, get_local_prevalence]
+__all__ = [
+    prevalencers,
+    get_global_prevalence,
+    get_local_prevalence,
+    predict_global_prevalence,
+    predict_local_prevalence,
+]
@@ -1,9 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from pathlib import Path
+
 import numpy as np
 
 
+def smooth_bin_errors(bin_errors: np.array, window: int):
+    return np.convolve(bin_errors, np.ones(window) / window, "same")
+
+
+def load_bin_errors(directory: Path, smooth_error_window=-1):
+    # smoothing is done once at load time, preferably by using the table written by
+    # scripts/calculate_error_bins.py --smooth <window>
+    if smooth_error_window > 0:
+        smoothed = directory / f"bin_errors_smooth{smooth_error_window}.npy"
+        if smoothed.exists():
+            return np.load(smoothed)
+        return smooth_bin_errors(
+            np.load(directory / "bin_errors.npy"), smooth_error_window
+        )
+    return np.load(directory / "bin_errors.npy")
+
+
 class BasePrevalence:
     def get_global_prevalence(self, term: str):
         raise NotImplementedError("subclass should implement this function")
@@ -15,8 +34,6 @@ class BasePrevalence:
         self, prediction: float, bin_errors: np.array, smooth_error_window=-1
     ):
         if smooth_error_window > 0:
-            bin_errors = np.convolve(
-                bin_errors, np.ones(smooth_error_window) / smooth_error_window, "same"
-            )
+            bin_errors = smooth_bin_errors(bin_errors, smooth_error_window)
         y = np.digitize(prediction, np.linspace(0, 1, bin_errors.shape[0] + 1))
         return 1 - bin_errors[y - 1]
@@ -9,18 +9,22 @@ from omegaconf import DictConfig
 from flair.data import Sentence
 from flair.embeddings import TransformerDocumentEmbeddings
 
-from .base import BasePrevalence
+from .base import BasePrevalence, load_bin_errors
 
 
 class SKLearnPrevalence(BasePrevalence):
     # NOTE: this model can only predict global prevalence, and predicts 0 for local prevalence/certainty
+    # the flair embeddings are not safe to share between threads
+    concurrency = "replicas"
+
     def __init__(self, cfg: DictConfig):
         sklearn_model_path = Path(cfg["sklearn_model_path"])
         self.regression_model = joblib.load(sklearn_model_path / "regression_model.pkl")
         # this is an array of mean absolute errors for each specific prediction bin
-        self.bin_errors = np.load(sklearn_model_path / "bin_errors.npy")
+        self.bin_errors = load_bin_errors(
+            sklearn_model_path, cfg.get("smooth_error_window", -1)
+        )
         self.embeddings = TransformerDocumentEmbeddings(cfg["embedding_model_path"])
-        self.smooth_error_window = cfg.get("smooth_error_window", -1)
 
     def get_global_prevalence(self, term: str):
         # get transformer embedding
@@ -30,11 +34,7 @@ class SKLearnPrevalence(BasePrevalence):
         global_prevalence = np.clip(
             self.regression_model.predict(e.reshape(1, -1)), 0, 1
         )
-        global_certainty = self.calculate_confidence(
-            global_prevalence,
-            self.bin_errors,
-            smooth_error_window=self.smooth_error_window,
-        )
+        global_certainty = self.calculate_confidence(global_prevalence, self.bin_errors)
         return global_prevalence, global_certainty
 
     def get_local_prevalence(self, term: str, context: str):
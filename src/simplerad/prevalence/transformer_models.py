@@ -1,18 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import copy
+from itertools import chain
 from pathlib import Path
 
-import numpy as np
 import torch as t
 from omegaconf import DictConfig
 from peft import LoraConfig, get_peft_model, set_peft_model_state_dict
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
-from .base import BasePrevalence
+from .base import BasePrevalence, load_bin_errors
 
 
 class GlobalLocalAdapterPrevalence(BasePrevalence):
+    # the adapter weights are swapped in place, so every replica needs its own
+    concurrency = "replicas"
+
     def __init__(self, cfg: DictConfig):
         base_model_name = cfg["base_model"]
         global_adapter = Path(cfg["global_adapter"])
@@ -34,6 +38,7 @@ class GlobalLocalAdapterPrevalence(BasePrevalence):
         self.model = get_peft_model(self.base_model, global_lora_config)
         self.model.to(self.device)
 
+        self.adapter = None
         self.global_state_dict = t.load(
             global_adapter / "adapter_model/adapter_model.bin",
             map_location=self.device,
@@ -43,23 +48,43 @@ class GlobalLocalAdapterPrevalence(BasePrevalence):
             map_location=self.device,
         )
 
-        self.global_bin_errors = np.load(global_adapter / "bin_errors.npy")
-        self.local_bin_errors = np.load(local_adapter / "bin_errors.npy")
         # default sub-0 means no smoothing
-        self.smooth_error_window = cfg.get("smooth_error_window", -1)
+        smooth_error_window = cfg.get("smooth_error_window", -1)
+        self.global_bin_errors = load_bin_errors(global_adapter, smooth_error_window)
+        self.local_bin_errors = load_bin_errors(local_adapter, smooth_error_window)
+
+    def replicate(self):
+        # only the base model weights and the loaded adapter weights are shared
+        memo = {
+            id(tensor): tensor
+            for name, tensor in chain(
+                self.model.named_parameters(), self.model.named_buffers()
+            )
+            if "lora_" not in name
+        }
+        for state_dict in (self.global_state_dict, self.local_state_dict):
+            memo.update((id(tensor), tensor) for tensor in state_dict.values())
+        return copy.deepcopy(self, memo)
+
+    def use_adapter(self, adapter: str):
+        # consecutive calls for the same adapter do not load it again
+        if self.adapter != adapter:
+            state_dict = (
+                self.global_state_dict if adapter == "global" else self.local_state_dict
+            )
+            set_peft_model_state_dict(self.model, state_dict)
+            self.adapter = adapter
 
     def get_global_prevalence(self, term: str):
         global_inputs = self.tokenizer(term, return_tensors="pt").to(self.device)
         with t.no_grad():
-            set_peft_model_state_dict(self.model, self.global_state_dict)
+            self.use_adapter("global")
             global_prevalence = (
                 t.sigmoid(self.model(**global_inputs).logits).cpu().numpy()[0]
             )
 
             global_certainty = self.calculate_confidence(
-                global_prevalence,
-                self.global_bin_errors,
-                smooth_error_window=self.smooth_error_window,
+                global_prevalence, self.global_bin_errors
             )
 
         return global_prevalence, global_certainty
@@ -69,15 +94,13 @@ class GlobalLocalAdapterPrevalence(BasePrevalence):
             self.device
         )
         with t.no_grad():
-            set_peft_model_state_dict(self.model, self.local_state_dict)
+            self.use_adapter("local")
             local_prevalence = (
                 t.sigmoid(self.model(**local_inputs).logits).cpu().numpy()[0]
             )
 
             local_certainty = self.calculate_confidence(
-                local_prevalence,
-                self.local_bin_errors,
-                smooth_error_window=self.smooth_error_window,
+                local_prevalence, self.local_bin_errors
             )
 
         return local_prevalence, local_certainty
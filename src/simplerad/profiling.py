@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hmac
+import json
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+from uuid import uuid4
+
+from omegaconf import DictConfig
+
+
+class RequestProfile:
+    """Samples the stacks of the threads that work on a single request.
+
+    Threads register themselves with `attach` while they run code for the request
+    (see `metrics.stage`), so concurrent requests do not show up in the profile.
+    The samples are kept as folded stacks, the input format of flamegraph.pl and
+    speedscope.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.threads = Counter()
+        self.stacks = Counter()
+        self.calls = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.start = perf_counter()
+        # known before the profile is finished, for the headers of the response
+        self.id = uuid4().hex
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                threads = [t for t, n in self.threads.items() if n > 0]
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self.fold(frame)] += 1
+
+    @staticmethod
+    def fold(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    @contextmanager
+    def attach(self):
+        ident = threading.get_ident()
+        with self.lock:
+            self.threads[ident] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.threads[ident] -= 1
+
+    def record(self, stage: str, detail: Optional[str], seconds: float):
+        with self.lock:
+            self.calls.append({"stage": stage, "detail": detail, "seconds": seconds})
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+        self.seconds = perf_counter() - self.start
+
+    def folded(self):
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def breakdown(self):
+        stages = defaultdict(float)
+        for call in self.calls:
+            stages[call["stage"]] += call["seconds"]
+        return dict(stages)
+
+
+class Profiler:
+    # opt-in profiling of single requests, enabled by config and an admin header
+
+    header = "X-Profile"
+
+    def __init__(self):
+        self.enabled = False
+        self.token = ""
+        self.interval = 0.005
+        self.output_dir = Path("profiles")
+
+    def set_config(self, config: DictConfig):
+        # without a token anyone could trigger profiling, so it stays off
+        self.enabled = config["enabled"] and bool(config["token"])
+        self.token = config["token"]
+        self.interval = config["interval"]
+        self.output_dir = Path(config["output_dir"])
+
+    def authorized(self, headers):
+        token = headers.get(self.header)
+        return (
+            self.enabled
+            and token is not None
+            and hmac.compare_digest(token.encode(), self.token.encode())
+        )
+
+    def start(self, headers):
+        if not self.authorized(headers):
+            return None
+        profile = RequestProfile(self.interval)
+        profile.sampler.start()
+        return profile
+
+    def finish(self, profile: RequestProfile, endpoint: str):
+        profile.stop()
+        profile_id = profile.id
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        (self.output_dir / f"{profile_id}.folded").write_text(profile.folded())
+        with open(self.output_dir / f"{profile_id}.json", "w") as f:
+            json.dump(
+                {
+                    "endpoint": endpoint,
+                    "seconds": profile.seconds,
+                    "stages": profile.breakdown(),
+                    "calls": profile.calls,
+                },
+                f,
+                indent=2,
+            )
+        return profile_id
+
+    def load(self, profile_id: str, suffix: str):
+        if not re.fullmatch(r"[0-9a-f]{32}", profile_id):
+            return None
+        path = self.output_dir / f"{profile_id}{suffix}"
+        return path.read_text() if path.exists() else None
+
+
+profiler = Profiler()
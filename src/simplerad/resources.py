@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# NLP resources shared by all backends of the process: spaCy pipelines and NLTK
+# models are loaded once, however many backends use them. spaCy consumers declare
+# the components they run; components that no consumer asked for are not loaded.
+
+import threading
+from collections import defaultdict
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable
+
+from . import metrics
+
+
+class Pipeline:
+    """A shared spaCy pipeline that runs only the components of one consumer."""
+
+    def __init__(self, nlp, components):
+        self.nlp = nlp
+        # in pipeline order, also components that are disabled by default
+        self.pipes = [(n, p) for n, p in nlp.components if n in components]
+
+    def __call__(self, text: str):
+        doc = self.nlp.make_doc(text)
+        for _, pipe in self.pipes:
+            doc = pipe(doc)
+        return doc
+
+
+def spacy_components(name: str):
+    # all components of an installed pipeline, read from its meta without loading it
+    import spacy
+
+    path = Path(name) if Path(name).exists() else spacy.util.get_package_path(name)
+    meta = spacy.util.get_model_meta(path)
+    return meta.get("components", meta.get("pipeline", []))
+
+
+def load_spacy(name: str, components: set):
+    # "blank:<lang>" gives a tokenizer-only pipeline that needs no model download
+    import spacy
+
+    if name.startswith("blank:"):
+        return spacy.blank(name[len("blank:") :])
+    exclude = [c for c in spacy_components(name) if c not in components]
+    return spacy.load(name, exclude=exclude)
+
+
+class ResourcePool:
+    def __init__(self):
+        self.resources = {}
+        self.lock = threading.Lock()
+        self.load_locks = defaultdict(threading.Lock)
+
+    def get(self, key, load, reuse=lambda resource: True):
+        # only one thread loads a given resource, the others wait for it
+        with self.lock:
+            load_lock = self.load_locks[key]
+        with load_lock:
+            resource = self.resources.get(key)
+            if resource is None or not reuse(resource):
+                start = perf_counter()
+                resource = load(resource)
+                metrics.MODEL_LOAD_SECONDS.labels("resources", key[1]).observe(
+                    perf_counter() - start
+                )
+                self.resources[key] = resource
+        return resource
+
+    def spacy(self, name: str, components: Iterable[str] = ()):
+        """The spaCy pipeline `name` running only `components`, after the tokenizer.
+
+        Components must include the ones they listen to, e.g. "tok2vec". Consumers
+        share one loaded pipeline; it is loaded again with the union of the
+        components when a consumer needs one that is not loaded yet.
+        """
+        components = set(components)
+
+        def load(loaded):
+            needed = components | set(loaded.component_names if loaded else ())
+            nlp = load_spacy(name, needed)
+            missing = needed - set(nlp.component_names)
+            if missing:
+                raise ValueError(f"spaCy pipeline {name} has no components {missing}")
+            return nlp
+
+        def reuse(loaded):
+            return components <= set(loaded.component_names)
+
+        return Pipeline(self.get(("spacy", name), load, reuse), components)
+
+    def nltk(self, resource: str):
+        """An NLTK resource, e.g. "tokenizers/punkt/dutch.pickle"."""
+
+        def load(_):
+            import nltk
+
+            return nltk.data.load(resource)
+
+        return self.get(("nltk", resource), load)
+
+
+resources = ResourcePool()
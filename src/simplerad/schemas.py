@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import List
+from typing import Dict, List, Literal, Optional, get_args
 
 from pydantic import BaseModel
 
-from .entities.schemas import EntityTaggerResponse
+from .entities.schemas import (
+    CompactEntityTaggerResponse,
+    CompactLinkedEntityTaggerResponse,
+    EntityTaggerResponse,
+    LinkedEntityTaggerResponse,
+)
 from .prevalence.schemas import PrevalenceResponse
-from .search.schemas import SearchResponse
+from .search.schemas import CompactSearchResponse, SearchResponse
 from .summarization.schemas import SummaryResponse
 from .classification.schemas import (
+    CompactSentenceClassificationResponse,
     TextClassificationResponse,
     SentenceClassificationResponse,
 )
@@ -19,12 +25,58 @@ class TextRequest(BaseModel):
     text: str
 
 
+class DocumentRequest(TextRequest):
+    # reports that are edited and sent again: with a document id, only the sentences
+    # that changed since the previous revision are analyzed
+    document_id: Optional[str] = None
+    revision: int = 0
+
+
 class TextContextRequest(TextRequest):
     context: str
 
 
+AnalyzeModule = Literal[
+    "entities",
+    "prevalence",
+    "sentence_classification",
+    "text_classification",
+    "summarize",
+]
+
+
+class AnalyzeRequest(DocumentRequest):
+    # prevalence is computed for the spans found by the entity tagger
+    modules: List[AnalyzeModule] = list(get_args(AnalyzeModule))
+    # optional engine per module, e.g. {"entities": "flair"}
+    engines: Dict[AnalyzeModule, str] = {}
+
+
+class AnalyzeResponse(BaseModel):
+    class Span(EntityTaggerResponse.Span):
+        global_prevalence: Optional[PrevalenceResponse]
+        local_prevalence: Optional[PrevalenceResponse]
+
+    text: str
+    sentences: List[EntityTaggerResponse.Span]
+    spans: Optional[List[Span]]
+    sentence_labels: Optional[List[List[SentenceClassificationResponse.Label]]]
+    text_labels: Optional[List[TextClassificationResponse.Label]]
+    summary: Optional[str]
+    # seconds spent per stage, plus the total
+    timings: Dict[str, float]
+
+
 __all__ = [
+    AnalyzeRequest,
+    AnalyzeResponse,
+    CompactEntityTaggerResponse,
+    CompactLinkedEntityTaggerResponse,
+    CompactSearchResponse,
+    CompactSentenceClassificationResponse,
+    DocumentRequest,
     EntityTaggerResponse,
+    LinkedEntityTaggerResponse,
     PrevalenceResponse,
     SearchResponse,
     SummaryResponse,
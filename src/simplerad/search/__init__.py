@@ -1,26 +1,87 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from ..utils import LazyValueDict, preprocess
-from .bm25 import BM25
-from .dense import FastTextFAISSJSONLFolderSearcher
-from .exact import ExactJSONLFolderSearcher
-from .fuzzy import SimstringJSONLFolderSearcher
-
-searchers = LazyValueDict(
-    {
-        "exact": ExactJSONLFolderSearcher,
-        "simstring": SimstringJSONLFolderSearcher,
-        "faiss": FastTextFAISSJSONLFolderSearcher,
-        "bm25": BM25,
+from typing import List, Optional
+
+from .. import metrics
+from ..utils import ModelRegistry, preprocess
+from .base import entity_id
+from .schemas import SearchResponse
+
+# fields of the catalog entities that are part of the API
+ENTITY_FIELDS = list(SearchResponse.SearchResult.Entity.__fields__)
+
+
+def make_searchers():
+    # a registry of its own, e.g. for every shard app served by one test process
+    return ModelRegistry(
+        "search",
+        {
+            "exact": "simplerad.search.exact.ExactJSONLFolderSearcher",
+            "simstring": "simplerad.search.fuzzy.SimstringJSONLFolderSearcher",
+            "simstring_sharded": "simplerad.search.fuzzy.ShardedSimstringSearcher",
+            "faiss": "simplerad.search.dense.FastTextFAISSJSONLFolderSearcher",
+            "bm25": "simplerad.search.bm25.BM25",
+            "distributed": "simplerad.search.distributed.DistributedSearcher",
+        },
+    )
+
+
+searchers = make_searchers()
+
+
+def get_search_results(
+    text: str, engine: Optional[str] = None, registry: Optional[ModelRegistry] = None
+):
+    return search_many([text], engine, registry)[0]
+
+
+def search_many(
+    texts: List[str],
+    engine: Optional[str] = None,
+    registry: Optional[ModelRegistry] = None,
+):
+    # several queries while holding the model once
+    queries = [preprocess(text)["text"] for text in texts]
+    with (registry or searchers).use(engine) as model:
+        results = model.search_batch(queries)
+    with metrics.stage("ranking"):
+        return [rank(r) for r in results]
+
+
+def rank(results):
+    results = sorted(results, key=lambda x: x["score"], reverse=True)
+    return {
+        "data": [
+            {"score": r["score"], "entity": public_entity(r["entity"])} for r in results
+        ]
+    }
+
+
+def public_entity(entity: dict):
+    return {k: entity[k] for k in ENTITY_FIELDS}
+
+
+def compact_search_results(results: dict):
+    return {
+        "data": [
+            {"id": entity_id(r["entity"]), "score": r["score"]} for r in results["data"]
+        ]
     }
-)
 
 
-def get_search_results(text: str):
-    preprocessed = preprocess(text)
-    results = searchers.get_model().search(preprocessed["text"])
-    return {"data": sorted(results, key=lambda x: x["score"], reverse=True)}
+def get_entity(
+    id: str, engine: Optional[str] = None, registry: Optional[ModelRegistry] = None
+):
+    entity = (registry or searchers).get_model(engine).get_entity(id)
+    return public_entity(entity) if entity is not None else None
 
 
-__all__ = [searchers, get_search_results]
+__all__ = [
+    make_searchers,
+    searchers,
+    get_search_results,
+    search_many,
+    compact_search_results,
+    get_entity,
+]
@@ -2,10 +2,26 @@
 # -*- coding: utf-8 -*-
 
 
+def entity_id(entity):
+    return f"{entity['source']}:{entity['source_id']}"
+
+
 class BaseSearcher:
+    # searchers only read their index, so calls may share one instance
+    concurrency = "reentrant"
+
     def search(self, text: str):
         raise NotImplementedError("subclass should implement this function")
 
+    def search_batch(self, texts):
+        return [self.search(text) for text in texts]
+
+    def get_entity(self, id: str):
+        # lookup by entity_id, searchers without known_entities should override this
+        if getattr(self, "entities_by_id", None) is None:
+            self.entities_by_id = {entity_id(e): e for e in self.known_entities}
+        return self.entities_by_id.get(id)
+
 
 class BaseTwoStageSearcher(BaseSearcher):
     def rank(self, query_terms, indexes):
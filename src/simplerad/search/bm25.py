@@ -4,7 +4,6 @@ import math
 from collections import defaultdict
 from functools import reduce
 
-import spacy
 from hydra import compose
 from omegaconf import DictConfig
 
@@ -13,9 +12,8 @@ from .base import BaseTwoStageSearcher
 
 
 class BaseInvertedIndex(BaseTwoStageSearcher):
-    def __init__(self, nlp, jsonl_directory, fields):
+    def __init__(self, jsonl_directory, fields):
         self.known_entities = read_jsonl_dir(jsonl_directory)
-        self.nlp = spacy.load(nlp)
 
         # build inverted index on title, description fields
         # TODO: add support for synonyms here as well?
@@ -35,7 +33,7 @@ class BaseInvertedIndex(BaseTwoStageSearcher):
             return []
 
         ent_indexes = reduce(
-            lambda x, y: x | y, [self.index[term] for term in query_terms]
+            lambda x, y: x | y, [self.index.get(term, set()) for term in query_terms]
         )
         scores = self.rank(query_terms, ent_indexes)
         return [
@@ -46,7 +44,7 @@ class BaseInvertedIndex(BaseTwoStageSearcher):
 
 class BM25(BaseInvertedIndex):
     def __init__(self, cfg: DictConfig):
-        super().__init__(cfg["spacy_model"], cfg["jsonl_directory"], cfg["fields"])
+        super().__init__(cfg["jsonl_directory"], cfg["fields"])
 
         self.b = cfg["b"]
         self.k1 = cfg["k1"]
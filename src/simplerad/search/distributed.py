@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Scatter-gather search over other simplerad instances. Every instance (shard)
+# serves a part of the entity lists with its own search backend, this searcher
+# sends each query to all of them and merges their results.
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import perf_counter
+from urllib.parse import quote, urlencode
+
+import orjson
+import urllib3
+from omegaconf import DictConfig
+
+from .. import metrics
+from ..utils import BackendUnavailableError
+from .base import BaseSearcher, entity_id
+
+logger = logging.getLogger("uvicorn")
+
+NORMALIZATIONS = ("max", "none")
+
+
+class DistributedSearcher(BaseSearcher):
+    """Searches all shards at once over pooled keep-alive connections.
+
+    Shards that fail or do not answer within `timeout` seconds are left out, as
+    long as at least `min_shards` answer. The merged scores are divided by the top
+    score of the query over all shards, or kept as they are; scaling per shard
+    would lift the best hit of every shard to the same score. Batches are sent in
+    parts of at most `max_items` texts, the limit of the shards' /search/.
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.shards = [url.rstrip("/") for url in cfg["shards"]]
+        if not self.shards:
+            raise ValueError("distributed search needs at least one shard")
+        self.engine = cfg.get("engine", None)
+        self.timeout = cfg["timeout"]
+        self.min_shards = cfg.get("min_shards", 1)
+        self.max_results = cfg.get("max_results", -1)
+        self.max_items = cfg.get("max_items", 100)
+        self.normalization = cfg.get("score_normalization", "max")
+        if self.normalization not in NORMALIZATIONS:
+            raise ValueError(
+                f"unknown score_normalization {self.normalization}, "
+                f"choose from {NORMALIZATIONS}"
+            )
+        self.http = urllib3.PoolManager(
+            num_pools=len(self.shards),
+            maxsize=cfg["pool_size"],
+            retries=False,
+            timeout=urllib3.Timeout(connect=cfg["connect_timeout"], read=self.timeout),
+            headers={"Content-Type": "application/json"},
+        )
+        self.executor = ThreadPoolExecutor(
+            len(self.shards) * cfg["pool_size"], thread_name_prefix="search-shard"
+        )
+
+    def url(self, shard: str, path: str):
+        query = f"?{urlencode({'engine': self.engine})}" if self.engine else ""
+        return f"{shard}{path}{query}"
+
+    def call(self, shard: str, method: str, path: str, body=None):
+        start = perf_counter()
+        response = self.http.request(
+            method,
+            self.url(shard, path),
+            body=orjson.dumps(body) if body is not None else None,
+        )
+        metrics.SEARCH_SHARD_SECONDS.labels(shard).observe(perf_counter() - start)
+        return response
+
+    def failed(self, shard: str, reason: str):
+        logger.warning(f"search shard {shard} left out: {reason}")
+        metrics.SEARCH_SHARD_FAILURES.labels(shard, reason.split(":")[0]).inc()
+
+    def scatter(self, method: str, path: str, bodies=(None,), ok=(200,)):
+        """The responses to all `bodies` of the shards that answered them in time
+        with an ok status."""
+        futures = {
+            shard: [
+                self.executor.submit(self.call, shard, method, path, body)
+                for body in bodies
+            ]
+            for shard in self.shards
+        }
+        # one deadline for all shards, the connections of slow shards time out by
+        # themselves
+        done, _ = wait(
+            [f for parts in futures.values() for f in parts], timeout=self.timeout
+        )
+        responses = {}
+        for shard, parts in futures.items():
+            reason = None
+            for future in parts:
+                if future not in done:
+                    reason = "timeout"
+                elif future.exception() is not None:
+                    e = future.exception()
+                    reason = f"{type(e).__name__}: {e}"
+                elif future.result().status not in ok:
+                    reason = f"status {future.result().status}"
+                if reason is not None:
+                    break
+            if reason is not None:
+                self.failed(shard, reason)
+            else:
+                responses[shard] = [future.result() for future in parts]
+        return responses
+
+    def normalize(self, results):
+        top = max((r["score"] for r in results), default=0)
+        if self.normalization == "none" or top <= 0:
+            return results
+        return [{**r, "score": r["score"] / top} for r in results]
+
+    def merge(self, shard_results):
+        # the same entity may be served by several shards, its best score counts
+        best = {}
+        for results in shard_results:
+            for r in results:
+                key = entity_id(r["entity"])
+                if key not in best or r["score"] > best[key]["score"]:
+                    best[key] = r
+        merged = sorted(
+            self.normalize(best.values()), key=lambda x: x["score"], reverse=True
+        )
+        return merged[: self.max_results] if self.max_results > 0 else merged
+
+    def search(self, text: str):
+        return self.search_batch([text])[0]
+
+    def search_batch(self, texts):
+        # requests of at most max_items texts, sent to all shards at once
+        size = self.max_items if self.max_items > 0 else max(len(texts), 1)
+        bodies = [
+            [{"text": t} for t in texts[i : i + size]]
+            for i in range(0, len(texts), size)
+        ]
+        responses = self.scatter("POST", "/search/", bodies)
+        if len(responses) < self.min_shards:
+            raise BackendUnavailableError(
+                f"{len(responses)} of {len(self.shards)} search shards answered, "
+                f"at least {self.min_shards} needed"
+            )
+        shard_results = [
+            [result for part in parts for result in orjson.loads(part.data)]
+            for parts in responses.values()
+        ]
+        return [
+            self.merge([r[i]["data"] for r in shard_results]) for i in range(len(texts))
+        ]
+
+    def get_entity(self, id: str):
+        path = f"/entity/{quote(id, safe='')}"
+        responses = self.scatter("GET", path, ok=(200, 404))
+        for (response,) in responses.values():
+            if response.status == 200:
+                return orjson.loads(response.data)
+        if len(responses) < len(self.shards):
+            # one of the missing shards may hold the entity
+            raise BackendUnavailableError(
+                f"{id} not found, {len(self.shards) - len(responses)} search shards "
+                "did not answer"
+            )
+        return None
+
+    def close(self):
+        # also for instances whose __init__ failed halfway
+        executor = getattr(self, "executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        http = getattr(self, "http", None)
+        if http is not None:
+            http.clear()
+
+    def __del__(self):
+        self.close()
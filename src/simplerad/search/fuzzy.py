@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import spacy
+import multiprocessing
+import os
+import threading
+import zlib
+from contextlib import ExitStack
+
 from hydra import compose
 from omegaconf import DictConfig
 from simstring.database.dict import DictDatabase
@@ -16,7 +21,6 @@ from .base import BaseSearcher
 class SimstringJSONLFolderSearcher(BaseSearcher):
     def __init__(self, cfg: DictConfig):
         self.known_entities = read_jsonl_dir(cfg["jsonl_directory"])
-        self.nlp = spacy.load(cfg["spacy_model"])
         self.db = DictDatabase(CharacterNgramFeatureExtractor(cfg["char_ngram"]))
         self.title2entity = {}
         for ent in self.known_entities:
@@ -32,7 +36,12 @@ class SimstringJSONLFolderSearcher(BaseSearcher):
         self.cosim_threshold = cfg["cosim_threshold"]
 
     def search(self, text: str):
-        matches = self.searcher.ranked_search(text.lower(), self.cosim_threshold)
+        return self.results(self.ranked_search(text.lower()))
+
+    def ranked_search(self, query: str):
+        return self.searcher.ranked_search(query, self.cosim_threshold)
+
+    def results(self, matches):
         results = []
         seen = set()
         for match in matches:
@@ -41,3 +50,180 @@ class SimstringJSONLFolderSearcher(BaseSearcher):
                 results.append(x)
                 seen.add(t)
         return results
+
+
+def serve_shard(conn, char_ngram: int):
+    # worker process: builds the database of one shard, then answers queries
+    db = DictDatabase(CharacterNgramFeatureExtractor(char_ngram))
+    for string in conn.recv():
+        db.add(string)
+    searcher = Searcher(db, CosineMeasure())
+    conn.send("ready")
+    while (request := conn.recv()) is not None:
+        query, threshold, max_results = request
+        matches = searcher.ranked_search(query, threshold) if db.strings else []
+        conn.send(matches[:max_results] if max_results > 0 else matches)
+
+
+class Shard:
+    """A worker process that serves a part of the strings. A query holds the lock
+    from sending until receiving, so replies cannot be read by another query."""
+
+    def __init__(self, strings, char_ngram: int):
+        self.strings = strings
+        self.char_ngram = char_ngram
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=serve_shard, args=(child, self.char_ngram), daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.conn.send(self.strings)
+
+    def ready(self):
+        try:
+            self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"search shard {self.process.pid} failed to start")
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    def restart(self):
+        self.stop()
+        self.start()
+        self.ready()
+
+
+class ShardedSimstringSearcher(SimstringJSONLFolderSearcher):
+    """Simstring search with the strings partitioned over worker processes.
+
+    With `partition: hash` every shard holds an even share of the strings and
+    queries run on all shards in parallel. With `partition: length` shards hold
+    strings of similar length, and only the shards that can hold matches above
+    the threshold are queried. Every shard returns at most `max_results` matches,
+    the best of which are merged.
+    """
+
+    def __init__(self, cfg: DictConfig):
+        self.known_entities = read_jsonl_dir(cfg["jsonl_directory"])
+        self.title2entity = {}
+        for ent in self.known_entities:
+            self.title2entity[ent["title"].lower()] = ent
+            for s in ent.get("synonyms", []):
+                self.title2entity[s.lower()] = ent
+        self.cosim_threshold = cfg["cosim_threshold"]
+        self.max_results = cfg.get("max_results", -1)
+        self.char_ngram = cfg["char_ngram"]
+        self.measure = CosineMeasure()
+
+        num_shards = cfg.get("shards", -1)
+        if num_shards <= 0:
+            num_shards = os.cpu_count()
+        strings = list(self.title2entity)
+        if cfg.get("partition", "hash") == "length":
+            shards, self.size_ranges = self.partition_by_length(strings, num_shards)
+        else:
+            shards = [[] for _ in range(num_shards)]
+            for string in strings:
+                shards[zlib.crc32(string.encode()) % num_shards].append(string)
+            self.size_ranges = None
+
+        self.shards = [Shard(strings, self.char_ngram) for strings in shards]
+        try:
+            for shard in self.shards:
+                shard.ready()
+        except BaseException:
+            self.close()
+            raise
+
+    def feature_size(self, string: str):
+        # number of character ngrams, strings are padded with one sentinel per side
+        return max(len(string) + 3 - self.char_ngram, 0)
+
+    def partition_by_length(self, strings, num_shards):
+        # contiguous feature size ranges with about the same number of strings each
+        strings = sorted(strings, key=self.feature_size)
+        shards, ranges = [], []
+        per_shard = -(-len(strings) // num_shards) or 1
+        for i in range(0, len(strings), per_shard):
+            shard = strings[i : i + per_shard]
+            low, high = self.feature_size(shard[0]), self.feature_size(shard[-1])
+            if ranges and ranges[-1][1] == low:
+                # keep strings of one size together
+                shards[-1].extend(s for s in shard if self.feature_size(s) == low)
+                shard = [s for s in shard if self.feature_size(s) != low]
+                if not shard:
+                    continue
+                low = self.feature_size(shard[0])
+            shards.append(shard)
+            ranges.append((low, high))
+        return shards, ranges
+
+    def targets(self, query: str):
+        if self.size_ranges is None:
+            return self.shards
+        size = self.feature_size(query)
+        low = self.measure.min_feature_size(size, self.cosim_threshold)
+        high = self.measure.max_feature_size(size, self.cosim_threshold)
+        return [
+            shard
+            for shard, (first, last) in zip(self.shards, self.size_ranges)
+            if first <= high and last >= low
+        ]
+
+    def ranked_search(self, query: str):
+        request = (query, self.cosim_threshold, self.max_results)
+        matches, failed = [], []
+        with ExitStack() as locks:
+            # shards that were sent the query and still owe a reply
+            pending = []
+            try:
+                for shard in self.targets(query):
+                    locks.enter_context(shard.lock)
+                    try:
+                        shard.conn.send(request)
+                        pending.append(shard)
+                    except OSError:
+                        failed.append(shard)
+                # every reply is read, also when a shard failed, so the pipes of
+                # the others stay in step with their queries
+                while pending:
+                    shard = pending[0]
+                    try:
+                        matches.extend(shard.conn.recv())
+                    except (EOFError, OSError):
+                        failed.append(shard)
+                    pending.pop(0)
+            finally:
+                # a pipe with a missing or unread reply is out of step, the shard
+                # is started anew before its lock is released
+                for shard in failed + pending:
+                    shard.restart()
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} search shards stopped and were restarted"
+            )
+        matches.sort(key=lambda x: (-x[0], x[1]))
+        return matches[: self.max_results] if self.max_results > 0 else matches
+
+    def close(self):
+        for shard in getattr(self, "shards", []):
+            shard.stop()
+        self.shards = []
+
+    def __del__(self):
+        # also when the registry evicts this model
+        self.close()
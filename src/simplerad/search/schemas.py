@@ -19,3 +19,12 @@ class SearchResponse(BaseModel):
         score: float
 
     data: List[SearchResult]
+
+
+class CompactSearchResponse(BaseModel):
+    class SearchResult(BaseModel):
+        # "<source>:<source_id>", details are available from /entity/
+        id: str
+        score: float
+
+    data: List[SearchResult]
@@ -2,26 +2,64 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from contextlib import asynccontextmanager
 from time import perf_counter
-from typing import List
+from typing import List, Optional, Union
 
+import anyio
 import hydra
 import uvicorn
-from fastapi import FastAPI
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    Response,
+)
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from omegaconf import DictConfig
+from hydra import compose
+from hydra.core.hydra_config import HydraConfig
+from hydra.core.override_parser.overrides_parser import OverridesParser
+from omegaconf import DictConfig, OmegaConf
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from . import metrics
+from .admission import admission
 from .classification import (
+    compact_sentence_classification,
     get_text_classification,
     get_sentence_classification,
     text_classifiers,
     sentence_classifiers,
 )
-from .entities import entity_taggers, get_entities
+from .entities import (
+    add_original_offsets,
+    compact_entities,
+    entity_taggers,
+    get_entities,
+    get_linked_entities,
+)
+from .incremental import (
+    classify_sentences_incremental,
+    classify_text_incremental,
+    sessions,
+    tag_entities_incremental,
+)
+from .live import live
+from .pipeline import analyze
+from .profiling import profiler
 from .prevalence import prevalencers, get_global_prevalence, get_local_prevalence
 from .schemas import (
+    AnalyzeRequest,
+    AnalyzeResponse,
+    CompactEntityTaggerResponse,
+    CompactLinkedEntityTaggerResponse,
+    CompactSearchResponse,
+    CompactSentenceClassificationResponse,
+    DocumentRequest,
     EntityTaggerResponse,
+    LinkedEntityTaggerResponse,
     PrevalenceResponse,
     SearchResponse,
     SummaryResponse,
@@ -30,18 +68,38 @@ from .schemas import (
     TextClassificationResponse,
     SentenceClassificationResponse,
 )
-from .search import get_search_results, searchers
+from .search import (
+    compact_search_results,
+    get_entity,
+    get_search_results,
+    search_many,
+    searchers,
+)
+from .streaming import streaming
 from .summarization import get_summaries, summarizers
+from .utils import (
+    BackendUnavailableError,
+    ModelRegistry,
+    UnknownEngineError,
+    finally_sent,
+    preprocess,
+    preprocess_cache,
+)
 
 logger = logging.getLogger("uvicorn")
 
-app = FastAPI(title="simplerad API")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origin_regex="http://localhost:.*",
-    allow_methods=["GET", "POST", "PUT"],
-    expose_headers=["X-Process-Time"],
-)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # sync endpoints run in the default thread pool, it needs a thread for every
+    # slot of the admission lanes; async endpoints run their thread calls on the
+    # threads of their lane, see Admission.run_sync
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, admission.threads())
+    yield
+
+
+router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -55,69 +113,414 @@ model_dicts = {
 }
 
 
-@app.middleware("http")
+async def admission_control(request, call_next):
+    return await admission.dispatch(request, call_next)
+
+
 async def processing_time_logger(request, call_next):
     start_time = perf_counter()
-    response = await call_next(request)
-    response.headers["X-Process-Time"] = f"{perf_counter() - start_time:.3f}s"
-    return response
+    stats = metrics.start_request()
+    profile = stats.profile = profiler.start(request.headers)
+
+    def finish():
+        profiler.finish(profile, metrics.endpoint_name(request.scope))
+
+    sent = None
+    try:
+        response = await call_next(request)
+        response.headers["X-Process-Time"] = f"{perf_counter() - start_time:.3f}s"
+        metrics.observe_request(request.scope, stats, start_time)
+        if profile is None:
+            return response
+        response.headers["X-Profile-Id"] = profile.id
+        # the stages until the headers; the body of /stream/ responses is produced
+        # after them, so their stored profile ends when the body is sent
+        response.headers["X-Profile-Stages"] = ";".join(
+            f"{k}={v:.4f}" for k, v in profile.breakdown().items()
+        )
+        sent = finally_sent(response, finish)
+        return sent
+    finally:
+        if profile is not None and sent is None:
+            finish()
+
+
+def fast_response(content, **kwargs):
+    # endpoints build their output themselves, so response_model validation is
+    # skipped and the content is encoded with orjson; response_model remains for
+    # the API documentation
+    with metrics.stage("serialization"):
+        return ORJSONResponse(content, **kwargs)
+
+
+async def unknown_engine_handler(request: Request, exc: UnknownEngineError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
 
+async def backend_unavailable_handler(request: Request, exc: BackendUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
 
-@app.get("/")
+
+@router.get("/")
 def status():
     return ""
 
 
-@app.post("/entities/", response_model=List[EntityTaggerResponse])
-def entities(req: List[TextRequest]):
+@router.get("/metrics")
+def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def profile(profile_id: str, request: Request, breakdown: bool = False):
+    # folded stacks (flamegraph.pl, speedscope) or the per-stage breakdown as json
+    if not profiler.authorized(request.headers):
+        raise HTTPException(status_code=404)
+    content = profiler.load(profile_id, ".json" if breakdown else ".folded")
+    if content is None:
+        raise HTTPException(status_code=404)
+    return content
+
+
+@router.get("/engines/")
+def engines(request: Request):
+    # backends that can be selected per request with ?engine=...
+    registries = {**model_dicts, "search": request.app.state.searchers}
+    return {module: models.engines for module, models in registries.items()}
+
+
+def tag(
+    text: str,
+    engine: Optional[str],
+    link: int,
+    search_engine: Optional[str],
+    registry: ModelRegistry,
+    document_id: Optional[str] = None,
+    revision: int = 0,
+):
+    if link > 0:
+        return get_linked_entities(text, link, engine, search_engine, registry)
+    if document_id is not None:
+        return tag_entities_incremental(preprocess(text), document_id, revision, engine)
+    return get_entities(text, engine)
+
+
+@router.post(
+    "/entities/",
+    response_model=Union[
+        List[EntityTaggerResponse],
+        List[CompactEntityTaggerResponse],
+        List[LinkedEntityTaggerResponse],
+        List[CompactLinkedEntityTaggerResponse],
+    ],
+)
+@metrics.instrumented
+@admission.limit_items
+def entities(
+    req: List[DocumentRequest],
+    request: Request,
+    engine: Optional[str] = None,
+    compact: bool = False,
+    link: int = 0,
+    search_engine: Optional[str] = None,
+    original_offsets: bool = False,
+):
+    # link=k adds the top k catalog entities to every span, so clients do not need
+    # a /search/ call per span; original_offsets adds offsets in the text as sent
     logger.info(f"> entities - processing {len(req)} items")
-    return [get_entities(r.text) for r in req]
+    registry = request.app.state.searchers
+    results = [
+        tag(r.text, engine, link, search_engine, registry, r.document_id, r.revision)
+        for r in req
+    ]
+    if original_offsets:
+        results = [add_original_offsets(r.text, x) for r, x in zip(req, results)]
+    if compact:
+        results = [compact_entities(r) for r in results]
+    return fast_response(results)
 
 
-@app.post("/search/", response_model=List[SearchResponse])
-def search(req: List[TextRequest]):
+@router.post(
+    "/search/",
+    response_model=Union[List[SearchResponse], List[CompactSearchResponse]],
+)
+@metrics.instrumented
+@admission.limit_items
+def search(
+    req: List[TextRequest],
+    request: Request,
+    engine: Optional[str] = None,
+    compact: bool = False,
+):
     logger.info(f"> search - processing {len(req)} items")
-    return [get_search_results(r.text) for r in req]
+    results = search_many([r.text for r in req], engine, request.app.state.searchers)
+    if compact:
+        results = [compact_search_results(r) for r in results]
+    return fast_response(results)
+
 
+@router.get("/entity/{id:path}", response_model=SearchResponse.SearchResult.Entity)
+def entity(id: str, request: Request, engine: Optional[str] = None):
+    # details for the ids of compact search results, these rarely change
+    result = get_entity(id, engine, request.app.state.searchers)
+    if result is None:
+        raise HTTPException(status_code=404)
+    return fast_response(result, headers={"Cache-Control": "max-age=3600"})
 
-@app.post("/summarize/", response_model=List[SummaryResponse])
-def summarize(req: List[TextRequest]):
+
+@router.post(
+    "/entity/", response_model=List[Optional[SearchResponse.SearchResult.Entity]]
+)
+@metrics.instrumented
+@admission.limit_items
+def entity_lookup(req: List[str], request: Request, engine: Optional[str] = None):
+    registry = request.app.state.searchers
+    return fast_response([get_entity(id, engine, registry) for id in req])
+
+
+@router.post("/summarize/", response_model=List[SummaryResponse])
+@metrics.instrumented
+@admission.limit_items
+def summarize(req: List[TextRequest], engine: Optional[str] = None):
     logger.info(f"> summarize - processing {len(req)} items")
-    return [get_summaries(r.text) for r in req]
+    return fast_response([get_summaries(r.text, engine) for r in req])
 
 
-@app.post("/prevalence/global", response_model=List[PrevalenceResponse])
-def prevalence(req: List[TextRequest]):
+@router.post("/prevalence/global", response_model=List[PrevalenceResponse])
+@metrics.instrumented
+@admission.limit_items
+def prevalence(req: List[TextRequest], engine: Optional[str] = None):
     logger.info(f"> prevalence/global - processing {len(req)} items")
-    return [get_global_prevalence(r.text) for r in req]
+    return fast_response([get_global_prevalence(r.text, engine) for r in req])
 
 
-@app.post("/prevalence/local", response_model=List[PrevalenceResponse])
-def prevalence(req: List[TextContextRequest]):
+@router.post("/prevalence/local", response_model=List[PrevalenceResponse])
+@metrics.instrumented
+@admission.limit_items
+def prevalence(req: List[TextContextRequest], engine: Optional[str] = None):
     logger.info(f"> prevalence/local - processing {len(req)} items")
-    return [get_local_prevalence(r.text, r.context) for r in req]
+    return fast_response([get_local_prevalence(r.text, r.context, engine) for r in req])
 
 
-@app.post(
-    "/sentence_classification/", response_model=List[SentenceClassificationResponse]
+@router.post(
+    "/sentence_classification/",
+    response_model=Union[
+        List[SentenceClassificationResponse],
+        List[CompactSentenceClassificationResponse],
+    ],
 )
-def sentence_classification(req: List[TextRequest]):
+@metrics.instrumented
+@admission.limit_items
+def sentence_classification(
+    req: List[DocumentRequest], engine: Optional[str] = None, compact: bool = False
+):
     logger.info(f"> sentence classification - processing {len(req)} items")
-    return [get_sentence_classification(r.text) for r in req]
+    results = [
+        (
+            classify_sentences_incremental(
+                preprocess(r.text), r.document_id, r.revision, engine
+            )
+            if r.document_id is not None
+            else get_sentence_classification(r.text, engine)
+        )
+        for r in req
+    ]
+    if compact:
+        results = [compact_sentence_classification(r) for r in results]
+    return fast_response(results)
 
 
-@app.post("/text_classification/", response_model=List[TextClassificationResponse])
-def text_classification(req: List[TextRequest]):
+@router.post("/text_classification/", response_model=List[TextClassificationResponse])
+@metrics.instrumented
+@admission.limit_items
+def text_classification(req: List[DocumentRequest], engine: Optional[str] = None):
     logger.info(f"> text classification - processing {len(req)} items")
-    return [get_text_classification(r.text) for r in req]
+    results = [
+        (
+            classify_text_incremental(
+                preprocess(r.text), r.document_id, r.revision, engine
+            )
+            if r.document_id is not None
+            else get_text_classification(r.text, engine)
+        )
+        for r in req
+    ]
+    return fast_response(results)
 
 
-@hydra.main(version_base=None, config_path="conf", config_name="config")
-def main(cfg: DictConfig):
-    # set the configuration built with Hydra
+@router.post("/analyze/", response_model=AnalyzeResponse)
+@metrics.instrumented
+async def analyze_report(req: AnalyzeRequest):
+    logger.info(f"> analyze - running {', '.join(req.modules)}")
+    document = (req.document_id, req.revision) if req.document_id is not None else None
+    return fast_response(await analyze(req.text, req.modules, req.engines, document))
+
+
+@router.websocket("/live/")
+async def live_analysis(websocket: WebSocket):
+    # edits in, results per module out, see live.py for the messages
+    await live.session(websocket)
+
+
+# NDJSON streaming variants of the bulk endpoints, one TextRequest (or
+# TextContextRequest) per line in, one result per line out, see streaming.py
+
+
+@router.post("/stream/entities/")
+async def stream_entities(
+    request: Request,
+    engine: Optional[str] = None,
+    compact: bool = False,
+    link: int = 0,
+    search_engine: Optional[str] = None,
+    original_offsets: bool = False,
+):
+    entity_taggers.resolve(engine)
+    registry = request.app.state.searchers
+    if search_engine is not None:
+        registry.resolve(search_engine)
+
+    def process(r: TextRequest):
+        result = tag(r.text, engine, link, search_engine, registry)
+        if original_offsets:
+            result = add_original_offsets(r.text, result)
+        return compact_entities(result) if compact else result
+
+    return streaming.response(request, TextRequest, process)
+
+
+@router.post("/stream/search/")
+async def stream_search(
+    request: Request, engine: Optional[str] = None, compact: bool = False
+):
+    registry = request.app.state.searchers
+    registry.resolve(engine)
+
+    def process(r: TextRequest):
+        result = get_search_results(r.text, engine, registry)
+        return compact_search_results(result) if compact else result
+
+    return streaming.response(request, TextRequest, process)
+
+
+@router.post("/stream/summarize/")
+async def stream_summarize(request: Request, engine: Optional[str] = None):
+    summarizers.resolve(engine)
+    return streaming.response(
+        request, TextRequest, lambda r: get_summaries(r.text, engine)
+    )
+
+
+@router.post("/stream/prevalence/global")
+async def stream_global_prevalence(request: Request, engine: Optional[str] = None):
+    prevalencers.resolve(engine)
+    return streaming.response(
+        request, TextRequest, lambda r: get_global_prevalence(r.text, engine)
+    )
+
+
+@router.post("/stream/prevalence/local")
+async def stream_local_prevalence(request: Request, engine: Optional[str] = None):
+    prevalencers.resolve(engine)
+    return streaming.response(
+        request,
+        TextContextRequest,
+        lambda r: get_local_prevalence(r.text, r.context, engine),
+    )
+
+
+@router.post("/stream/sentence_classification/")
+async def stream_sentence_classification(
+    request: Request, engine: Optional[str] = None, compact: bool = False
+):
+    sentence_classifiers.resolve(engine)
+
+    def process(r: TextRequest):
+        result = get_sentence_classification(r.text, engine)
+        return compact_sentence_classification(result) if compact else result
+
+    return streaming.response(request, TextRequest, process)
+
+
+@router.post("/stream/text_classification/")
+async def stream_text_classification(request: Request, engine: Optional[str] = None):
+    text_classifiers.resolve(engine)
+    return streaming.response(
+        request, TextRequest, lambda r: get_text_classification(r.text, engine)
+    )
+
+
+def create_app(search: Optional[ModelRegistry] = None):
+    """The API, searching with the `search` registry instead of the configured one.
+
+    Apps with registries of their own can run side by side in one process, e.g. as
+    the shards of a distributed search in tests. The other modules are shared.
+    """
+    app = FastAPI(title="simplerad API", lifespan=lifespan)
+    app.state.searchers = search if search is not None else searchers
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origin_regex="http://localhost:.*",
+        allow_methods=["GET", "POST", "PUT"],
+        expose_headers=["X-Process-Time", "X-Profile-Id", "X-Profile-Stages"],
+    )
+    # added before the timing middleware so it runs inside it, queueing time and
+    # rejections are part of the request metrics
+    app.middleware("http")(admission_control)
+    app.middleware("http")(processing_time_logger)
+    app.add_exception_handler(UnknownEngineError, unknown_engine_handler)
+    app.add_exception_handler(BackendUnavailableError, backend_unavailable_handler)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
+
+
+def engine_overrides(module: str, engine: str, overrides: List[str]):
+    # the overrides of the configuration apply to the extra engines as well, except
+    # the choice of the default engine and keys that the engine's config lacks
+    selected = compose(config_name="config", overrides=[f"{module}={engine}"])
+    missing = object()
+    result = [f"{module}={engine}"]
+    for override in OverridesParser.create().parse_overrides(list(overrides)):
+        key, line = override.key_or_group, override.input_line
+        if key == module:
+            continue
+        if key.startswith(f"{module}.") and not override.is_force_add():
+            exists = OmegaConf.select(selected, key, default=missing) is not missing
+            if override.is_add() and exists:
+                line = line[1:]
+            elif not override.is_add() and not exists:
+                logger.warning(f"override {line} does not apply to {module}={engine}")
+                continue
+        result.append(line)
+    return result
+
+
+def configure(cfg: DictConfig, overrides: List[str] = ()):
+    # set the configuration built with Hydra from `overrides`, needs an initialized
+    # Hydra to compose the extra engines
+    preprocess_cache.resize(cfg.preprocess_cache_size)
+    profiler.set_config(cfg.profiling)
+    admission.set_config(cfg.admission)
+    streaming.set_config(cfg.streaming)
+    sessions.set_config(cfg.incremental)
+    live.set_config(cfg.live)
     for module, models in model_dicts.items():
-        models.set_config(cfg[module])
+        models.set_config(cfg[module], cfg.registry.memory_budget_mb)
+        # extra engines are composed from their config group, e.g. search=bm25
+        for engine in cfg.registry.engines.get(module, []):
+            extra = compose(
+                config_name="config",
+                overrides=engine_overrides(module, engine, overrides),
+            )
+            models.add_config(extra[module])
+
 
+@hydra.main(version_base=None, config_path="conf", config_name="config")
+def main(cfg: DictConfig):
+    configure(cfg, HydraConfig.get().overrides.task)
     uvicorn.run(app)
 
 
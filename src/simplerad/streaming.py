@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# NDJSON variants of the bulk endpoints. The request body is read line by line
+# while results are written, so memory use does not grow with the upload and
+# clients see the first results right away. Backpressure comes for free: the next
+# lines are only read once the current micro-batch is written, and writing waits
+# for the client to keep up.
+
+import logging
+from typing import Callable, Type
+
+import orjson
+from omegaconf import DictConfig
+from pydantic import BaseModel, ValidationError
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import StreamingResponse
+
+from . import metrics
+from .admission import admission
+
+logger = logging.getLogger("uvicorn")
+
+
+class NDJSONResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        # the body iterator reads the request body itself, the disconnect listener
+        # of StreamingResponse would compete with it for the request messages
+        await self.stream_response(send)
+
+
+class LineTooLong(Exception):
+    pass
+
+
+async def read_lines(request: Request, max_line_bytes: int):
+    # yields the lines of the request body, or LineTooLong for lines that do not
+    # fit in memory, without buffering more than one line
+    buffer = b""
+    skipping = False
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+            else:
+                yield line if len(line) <= max_line_bytes else LineTooLong()
+        if len(buffer) > max_line_bytes:
+            if not skipping:
+                yield LineTooLong()
+            skipping = True
+            buffer = b""
+    if buffer and not skipping:
+        yield buffer
+
+
+def error(line: int, message: str):
+    return {"line": line, "error": message}
+
+
+class Streaming:
+    def __init__(self):
+        self.batch_size = 8
+        self.max_line_bytes = 2**20
+
+    def set_config(self, config: DictConfig):
+        self.batch_size = config["batch_size"]
+        self.max_line_bytes = config["max_line_bytes"]
+
+    def response(
+        self,
+        request: Request,
+        schema: Type[BaseModel],
+        process: Callable,
+    ):
+        """Stream `process(item)` for every non-empty line of the request body.
+
+        Every non-empty line produces exactly one output line, in order. Lines that are
+        not valid or fail to process produce `{"line": <n>, "error": "..."}` instead
+        of ending the stream, so one bad report does not abort a backfill.
+        """
+        endpoint = metrics.endpoint_name(request.scope)
+
+        def run_batch(batch):
+            results = []
+            for line, item in batch:
+                if isinstance(item, dict):
+                    results.append(item)
+                    continue
+                try:
+                    results.append(process(item))
+                except Exception as e:
+                    logger.exception(f"{endpoint} failed on line {line}")
+                    results.append(error(line, f"{type(e).__name__}: {e}"))
+            with metrics.stage("serialization"):
+                return b"".join(orjson.dumps(r) + b"\n" for r in results)
+
+        async def results():
+            batch = []
+            line = 0
+            try:
+                async for raw in read_lines(request, self.max_line_bytes):
+                    line += 1
+                    if isinstance(raw, LineTooLong):
+                        item = error(line, f"line exceeds {self.max_line_bytes} bytes")
+                    elif not raw.strip():
+                        continue
+                    else:
+                        try:
+                            item = schema.parse_obj(orjson.loads(raw))
+                        except (orjson.JSONDecodeError, ValidationError) as e:
+                            item = error(line, str(e))
+                    batch.append((line, item))
+                    if len(batch) >= self.batch_size:
+                        yield await admission.run_sync(run_batch, batch)
+                        metrics.STREAM_ITEMS.labels(endpoint).inc(len(batch))
+                        batch = []
+            except ClientDisconnect:
+                logger.info(f"{endpoint} client disconnected after {line} lines")
+                return
+            if batch and not await request.is_disconnected():
+                yield await admission.run_sync(run_batch, batch)
+                metrics.STREAM_ITEMS.labels(endpoint).inc(len(batch))
+
+        return NDJSONResponse(results())
+
+
+streaming = Streaming()
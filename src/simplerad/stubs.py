@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Stand-in backends that need no model files or downloads. They return
+# deterministic, plausibly shaped output and can simulate inference cost with
+# `latency_ms`, so benchmarks, load tests and frontend development run offline,
+# e.g. `simplerad entities=stub text_classification=stub`.
+
+import re
+import time
+import zlib
+
+from omegaconf import DictConfig
+
+from .classification.base import BaseSentenceClassifier, BaseTextClassifier
+from .entities.base import BasePredictor
+from .prevalence.base import BasePrevalence
+from .summarization.base import BaseSummarizer
+
+
+def pseudo_random(text: str):
+    # deterministic value in [0, 1) per text
+    return zlib.crc32(text.encode()) / 2**32
+
+
+class StubModel:
+    concurrency = "reentrant"
+
+    def __init__(self, cfg: DictConfig):
+        self.latency = cfg.get("latency_ms", 0) / 1000
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+class StubPredictor(StubModel, BasePredictor):
+    # tags every word of at least `min_length` characters
+    def __init__(self, cfg: DictConfig):
+        super().__init__(cfg)
+        self.pattern = re.compile(rf"\w{{{cfg.get('min_length', 8)},}}")
+
+    def predict(self, text):
+        self.wait()
+        return [
+            {"start": m.start(), "end": m.end(), "text": m.group()}
+            for m in self.pattern.finditer(text["text"])
+        ]
+
+
+class StubLabeler(StubModel):
+    def __init__(self, cfg: DictConfig):
+        super().__init__(cfg)
+        self.labels = list(cfg.get("labels", ["POSITIVE", "NEGATIVE"]))
+
+    def label(self, text: str):
+        scores = [pseudo_random(f"{label} {text}") for label in self.labels]
+        total = sum(scores) or 1
+        return [
+            {"value": label, "score": score / total}
+            for label, score in zip(self.labels, scores)
+        ]
+
+
+class StubTextClassifier(StubLabeler, BaseTextClassifier):
+    def predict(self, text):
+        self.wait()
+        return self.label(text["text"])
+
+
+class StubSentenceClassifier(StubLabeler, BaseSentenceClassifier):
+    def predict(self, text):
+        self.wait()
+        return [self.label(sent["text"]) for sent in text["sentences"]]
+
+
+class StubPrevalence(StubModel, BasePrevalence):
+    def get_global_prevalence(self, term: str):
+        self.wait()
+        return pseudo_random(term), pseudo_random(term[::-1])
+
+    def get_local_prevalence(self, term: str, context: str):
+        self.wait()
+        return pseudo_random(f"{term} {context}"), pseudo_random(term[::-1])
+
+
+class StubSummarizer(StubModel, BaseSummarizer):
+    # "summarizes" by keeping the first sentences
+    def __init__(self, cfg: DictConfig):
+        super().__init__(cfg)
+        self.max_sentences = cfg.get("max_sentences", 2)
+
+    def summarize(self, text: str):
+        self.wait()
+        return "\n".join(text.split("\n")[: self.max_sentences])
@@ -1,20 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from ..utils import LazyValueDict, preprocess
-from .abstractive import TransformerAbstractiveSummarizer
+from typing import List, Optional
 
-summarizers = LazyValueDict(
+from ..utils import ModelRegistry, preprocess
+
+summarizers = ModelRegistry(
+    "summarize",
     {
-        "transformer_abstractive": TransformerAbstractiveSummarizer,
-    }
+        "transformer_abstractive": "simplerad.summarization.abstractive.TransformerAbstractiveSummarizer",
+        "stub": "simplerad.stubs.StubSummarizer",
+    },
 )
 
 
-def get_summaries(text: str):
-    preprocessed = preprocess(text)
-    summary = summarizers.get_model().summarize(preprocessed["text"])
+def get_summaries(text: str, engine: Optional[str] = None):
+    return summarize_text(preprocess(text), engine)
+
+
+def summarize_text(preprocessed: dict, engine: Optional[str] = None):
+    with summarizers.use(engine) as model:
+        summary = model.summarize(preprocessed["text"])
     return {"summary": summary}
 
 
-__all__ = [summarizers, get_summaries]
+def summarize_batch(preprocessed: List[dict], engine: Optional[str] = None):
+    with summarizers.use(engine) as model:
+        summaries = model.summarize_batch([p["text"] for p in preprocessed])
+    return [{"summary": s} for s in summaries]
+
+
+__all__ = [summarizers, get_summaries, summarize_text, summarize_batch]
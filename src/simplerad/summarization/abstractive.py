@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from typing import List
+
 import torch as t
 from hydra import compose
 from omegaconf import DictConfig
@@ -10,6 +12,9 @@ from .base import BaseSummarizer
 
 
 class TransformerAbstractiveSummarizer(BaseSummarizer):
+    # fast tokenizers fail when several threads use them at once
+    concurrency = "replicas"
+
     def __init__(self, cfg: DictConfig):
         self.device = "cuda" if t.cuda.is_available() else "cpu"
         self.tokenizer = AutoTokenizer.from_pretrained(cfg["tokenizer"])
@@ -22,3 +27,12 @@ class TransformerAbstractiveSummarizer(BaseSummarizer):
             self.model.generate(**tokenized, max_length=self.max_len).detach().cpu()
         )
         return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
+
+    def summarize_batch(self, texts: List[str]):
+        tokenized = self.tokenizer(texts, return_tensors="pt", padding=True).to(
+            self.device
+        )
+        outputs = (
+            self.model.generate(**tokenized, max_length=self.max_len).detach().cpu()
+        )
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
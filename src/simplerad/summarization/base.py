@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from typing import List
+
 
 class BaseSummarizer:
     def summarize(self, text: str):
         raise NotImplementedError("subclass should implement this function")
+
+    def summarize_batch(self, texts: List[str]):
+        # backends that can generate for several texts at once override this
+        return [self.summarize(text) for text in texts]
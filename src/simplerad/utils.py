@@ -1,44 +1,172 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import copy
+import hashlib
+import importlib
 import json
+import os
 import re
-from collections import UserDict
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import partial
+from itertools import chain
 from pathlib import Path
+from time import perf_counter
+from typing import NamedTuple, Optional, Tuple
 
-import nltk
-from gensim.utils import simple_preprocess as sp
 from omegaconf import DictConfig
 
-nltk_tokenizer = nltk.data.load("tokenizers/punkt/dutch.pickle")
+from . import metrics
+from .resources import resources
+
+
+def sentence_tokenizer():
+    # loading the punkt pickle takes a while, only do it on first use
+    return resources.nltk("tokenizers/punkt/dutch.pickle")
 
 
 def simple_tokenize(text):
-    return sp(text, max_len=100)
+    from gensim.utils import simple_preprocess
 
+    return simple_preprocess(text, max_len=100)
 
-def preprocess(text: str):
+
+class LRUCache:
+    """Thread-safe mapping that holds at most `maxsize` items, dropping the least
+    recently used ones first."""
+
+    def __init__(self, name: str, maxsize: int):
+        # name labels the hit/miss metrics
+        self.name = name
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                metrics.CACHE_REQUESTS.labels(self.name, "miss").inc()
+                return default
+            metrics.CACHE_REQUESTS.labels(self.name, "hit").inc()
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def resize(self, maxsize: int):
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.data) > max(maxsize, 0):
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+def text_key(text: str):
+    # compact cache key, so the cache does not keep whole reports alive
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class Segmentation(NamedTuple):
+    # sentences joined by newlines
+    text: str
+    # per sentence: (start, end) in text and (start, end) in the normalized input
+    sentences: Tuple[Tuple[int, int, int, int], ...]
+    # offsets in the normalized input from which the offset in the original input
+    # shifts, because a whitespace run before it was collapsed
+    normalized_offsets: Tuple[int, ...]
+    original_offsets: Tuple[int, ...]
+
+    def to_original(self, offset: int):
+        # offset in text -> offset in the original input
+        starts = [sentence[0] for sentence in self.sentences]
+        sent_start, _, normalized_start, _ = self.sentences[
+            max(bisect_right(starts, offset) - 1, 0)
+        ]
+        offset = normalized_start + offset - sent_start
+        i = bisect_right(self.normalized_offsets, offset) - 1
+        return offset + self.original_offsets[i] - self.normalized_offsets[i]
+
+
+preprocess_cache = LRUCache("preprocess", 1024)
+
+
+def segment(text: str) -> Segmentation:
+    key = text_key(text)
+    segmentation = preprocess_cache.get(key)
+    if segmentation is None:
+        segmentation = segment_uncached(text)
+        preprocess_cache.put(key, segmentation)
+    return segmentation
+
+
+def segment_uncached(text: str) -> Segmentation:
     normalized = re.sub(r"\s+", " ", text)
+    normalized_offsets, original_offsets = [0], [0]
+    removed = 0
+    for match in re.finditer(r"\s{2,}", text):
+        start, end = match.span()
+        removed += end - start - 1
+        normalized_offsets.append(end - removed)
+        original_offsets.append(end)
+
+    sentences = []
+    offset = 0
+    spans = sentence_tokenizer().span_tokenize(normalized, realign_boundaries=True)
+    for start, end in spans:
+        # spans can still start or end with the single space between sentences
+        if normalized.startswith(" ", start):
+            start += 1
+        if end > start and normalized[end - 1] == " ":
+            end -= 1
+        if start == end:
+            continue
+        sentences.append((offset, offset + end - start, start, end))
+        offset += end - start + 1  # account for the newline between sentences
 
-    if len(normalized) == 0:
-        # empty input?
-        return {"text": "", "sentences": []}
+    return Segmentation(
+        "\n".join(normalized[start:end] for _, _, start, end in sentences),
+        tuple(sentences),
+        tuple(normalized_offsets),
+        tuple(original_offsets),
+    )
 
-    sents = nltk_tokenizer.tokenize(normalized, realign_boundaries=True)
-    bounds = [(0, len(sents[0]))]
 
-    for i, sent in enumerate(sents[1:], start=1):
-        start = bounds[i - 1][1] + 1  # account for whitespace between sentences
-        bounds.append((start, start + len(sent)))
+def preprocess(text: str):
+    with metrics.stage("preprocess"):
+        segmentation = segment(text)
     return {
-        "text": "\n".join(sents),
+        "text": segmentation.text,
         "sentences": [
-            {"start": start, "end": end, "text": sent}
-            for ((start, end), sent) in zip(bounds, sents)
+            {"start": start, "end": end, "text": segmentation.text[start:end]}
+            for start, end, _, _ in segmentation.sentences
         ],
     }
 
 
+def to_original_span(text: str, start: int, end: int):
+    """Map a span in preprocess(text)["text"] back to a span in text itself."""
+    segmentation = segment(text)
+    if not segmentation.sentences:
+        return start, end
+    original_start = segmentation.to_original(start)
+    if end <= start:
+        return original_start, original_start
+    return original_start, segmentation.to_original(end - 1) + 1
+
+
 def read_json(fname):
     with open(fname) as f:
         return json.load(f)
@@ -56,26 +184,345 @@ def read_jsonl_dir(path):
     return items
 
 
-class LazyValueDict:
-    def __init__(self, initial_data):
-        self.data = initial_data
-        self.hotkey = None
-        self.value = None
-        self.config = None
+class UnknownEngineError(ValueError):
+    pass
+
+
+class BackendUnavailableError(RuntimeError):
+    # a backend depends on a service that is down
+    pass
+
+
+def finally_sent(response, callback):
+    """`response` as an ASGI app that calls `callback` once it is sent, also when
+    sending fails or the client is gone before the body starts."""
+
+    async def send_response(scope, receive, send):
+        try:
+            await response(scope, receive, send)
+        finally:
+            callback()
+
+    return send_response
+
+
+def import_string(path: str):
+    # "package.module.Class" -> Class
+    module_name, _, attr = path.rpartition(".")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def current_rss():
+    # resident set size of this process in bytes, 0 where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# models whose size is measured from the RSS load one at a time, in all registries
+measure_lock = threading.Lock()
+
+
+def replicate(model, shared=lambda name: True):
+    """Copy of a model for use by another thread. The parameters and buffers of its
+    torch modules whose names pass `shared` are shared with `model`, everything else
+    is copied."""
+    memo = {}
+    for value in vars(model).values():
+        if callable(getattr(value, "named_parameters", None)):
+            for name, tensor in chain(value.named_parameters(), value.named_buffers()):
+                if shared(name):
+                    memo[id(tensor)] = tensor
+    return copy.deepcopy(model, memo)
 
-    def set_config(self, config: DictConfig):
-        self.config = config
 
-    def get_model(self):
-        if self.config is None:
+CONCURRENCY = ("reentrant", "lock", "replicas")
+
+
+class ModelPool:
+    """The instances of one model that calls can use at the same time.
+
+    Backends declare how they may be called concurrently in a `concurrency`
+    attribute, which the `concurrency` config value overrides:
+
+    - reentrant: any number of calls on the one instance,
+    - lock: one call at a time,
+    - replicas: one call at a time per instance; up to `replicas` instances are
+      made by `replicate()` when calls would wait otherwise, sharing the weights.
+      The loaded model itself is not called then, so it is never copied halfway a
+      call.
+
+    A closed pool closes its instances that have a close() method once the calls
+    that still use them return.
+    """
+
+    def __init__(
+        self,
+        model,
+        concurrency: str = "lock",
+        replicas: int = 1,
+        replica_size: Optional[int] = None,
+        grown=lambda size: None,
+    ):
+        if concurrency not in CONCURRENCY:
+            raise ValueError(
+                f"unknown concurrency {concurrency}, choose from {CONCURRENCY}"
+            )
+        self.model = model
+        self.reentrant = concurrency == "reentrant"
+        self.size = max(replicas, 1) if concurrency == "replicas" else 1
+        self.free = [model] if self.size == 1 else []
+        self.instances = len(self.free)
+        self.available = threading.Condition()
+        # bytes per replica, measured from the RSS if None; `grown` is told the size
+        # of every replica made
+        self.replica_size = replica_size
+        self.grown = grown
+        self.users = 0
+        self.closed = False
+
+    def replicate(self):
+        # backends whose state is not all safe to share override replicate()
+        if callable(getattr(self.model, "replicate", None)):
+            return self.model.replicate()
+        return replicate(self.model)
+
+    def add_replica(self):
+        with measure_lock if self.replica_size is None else nullcontext():
+            before = current_rss()
+            instance = self.replicate()
+            size = self.replica_size
+            if size is None:
+                size = current_rss() - before
+        self.grown(max(size, 0))
+        return instance
+
+    @contextmanager
+    def checkout(self):
+        with self.available:
+            self.users += 1
+        try:
+            if self.reentrant:
+                yield self.model
+            else:
+                with self.instance() as instance:
+                    yield instance
+        finally:
+            with self.available:
+                self.users -= 1
+                last = self.closed and self.users == 0
+            if last:
+                self.close_instances()
+
+    @contextmanager
+    def instance(self):
+        with self.available:
+            while not self.free and self.instances >= self.size:
+                self.available.wait()
+            instance = self.free.pop() if self.free else None
+            if instance is None:
+                self.instances += 1
+        if instance is None:
+            try:
+                instance = self.add_replica()
+            except BaseException:
+                with self.available:
+                    self.instances -= 1
+                    self.available.notify()
+                raise
+        try:
+            yield instance
+        finally:
+            with self.available:
+                self.free.append(instance)
+                self.available.notify()
+
+    def close(self):
+        with self.available:
+            self.closed = True
+            idle = self.users == 0
+        if idle:
+            self.close_instances()
+
+    def close_instances(self):
+        # e.g. the worker processes of sharded searchers
+        instances = [self.model] + [i for i in self.free if i is not self.model]
+        for instance in instances:
+            if callable(getattr(instance, "close", None)):
+                instance.close()
+
+
+class ModelRegistry:
+    """Keeps several named backends of one module resident at once.
+
+    Backends may be given as classes or as "package.module.Class" strings; the
+    latter are only imported when the backend is first constructed, so startup
+    does not pay for the dependencies of unused backends.
+
+    Models are constructed on first use. Their size is the `memory_mb` config value,
+    or else estimated from the growth of the process RSS while they load; such loads
+    run one at a time in the process, so they do not count each other's memory. The
+    replicas of a model add to its size as they are made, `memory_mb` each or their
+    measured growth. The least recently used models are evicted once the estimated
+    total exceeds the memory budget, and closed if they have a close() method.
+
+    Every model is used through a ModelPool, so calls from several threads are as
+    concurrent as the backend allows.
+    """
+
+    def __init__(self, module: str, backends):
+        # module name labels the metrics of this registry
+        self.module = module
+        self.backends = backends
+        self.configs = {}
+        self.default = None
+        self.memory_budget = -1
+        self.models = OrderedDict()
+        self.sizes = {}
+        # the current load of every model, replicas of earlier loads do not count
+        self.loads = {}
+        self.lock = threading.Lock()
+        self.load_locks = defaultdict(threading.Lock)
+
+    def set_config(self, config: DictConfig, memory_budget_mb: float = -1):
+        with self.lock:
+            self.configs = {}
+            pools = list(self.models.values())
+            self.models.clear()
+            self.sizes.clear()
+            self.loads.clear()
+        for pool in pools:
+            pool.close()
+        self.default = config["name"]
+        self.memory_budget = memory_budget_mb * 2**20 if memory_budget_mb > 0 else -1
+        self.add_config(config)
+
+    def add_config(self, config: DictConfig):
+        # make another backend selectable per request, keyed by its name
+        if config["name"] not in self.backends:
+            raise UnknownEngineError(f"no backend registered for {config['name']}")
+        self.configs[config["name"]] = config
+
+    @property
+    def engines(self):
+        return list(self.configs)
+
+    def resolve(self, engine: Optional[str] = None):
+        if self.default is None:
             raise ValueError(
                 "first call set_config before trying to initialize/access lazy values"
             )
-        key = self.config["name"]
-        if key == self.hotkey and self.value:
-            # already loaded model
-            return self.value
-        # cache different model
-        self.hotkey = key
-        self.value = self.data[key](self.config)
-        return self.value
+        key = engine or self.default
+        if key not in self.configs:
+            raise UnknownEngineError(
+                f"engine {key} is not configured, choose from {self.engines}"
+            )
+        return key
+
+    def get_model(self, engine: Optional[str] = None):
+        return self.get_pool(engine).model
+
+    def get_pool(self, engine: Optional[str] = None):
+        key = self.resolve(engine)
+
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+            load_lock = self.load_locks[key]
+
+        # only one thread constructs a given model, the others wait for it
+        with load_lock:
+            with self.lock:
+                if key in self.models:
+                    self.models.move_to_end(key)
+                    return self.models[key]
+
+            config = self.configs[key]
+            start = perf_counter()
+            size = config.get("memory_mb", None)
+            with measure_lock if size is None else nullcontext():
+                before = current_rss()
+                backend = self.backends[key]
+                if isinstance(backend, str):
+                    backend = self.backends[key] = import_string(backend)
+                model = backend(config)
+                size = size * 2**20 if size is not None else current_rss() - before
+            # a token instead of the pool, which would then reference itself and
+            # outlive its eviction until the cyclic garbage collector runs
+            load = object()
+            pool = ModelPool(
+                model,
+                config.get("concurrency", getattr(model, "concurrency", "lock")),
+                config.get("replicas", 1),
+                size if config.get("memory_mb", None) is not None else None,
+                partial(self.grown, key, load),
+            )
+            metrics.MODEL_LOAD_SECONDS.labels(self.module, key).observe(
+                perf_counter() - start
+            )
+
+            with self.lock:
+                self.models[key] = pool
+                self.sizes[key] = max(size, 0)
+                self.loads[key] = load
+                metrics.MODEL_MEMORY_BYTES.labels(self.module, key).set(self.sizes[key])
+                evicted = self.evict(keep=key)
+            for evicted_pool in evicted:
+                evicted_pool.close()
+        return pool
+
+    @contextmanager
+    def use(self, engine: Optional[str] = None):
+        """Get a model for a single inference call, recording how long callers wait
+        for it and how long the call takes."""
+        key = self.resolve(engine)
+        labels = (self.module, key)
+
+        with ExitStack() as stack:
+            metrics.INFERENCE_QUEUE_DEPTH.labels(*labels).inc()
+            try:
+                with metrics.stage("get_model", f"{self.module}/{key}"):
+                    # waits for a free instance of models that are not reentrant
+                    model = stack.enter_context(self.get_pool(key).checkout())
+            finally:
+                metrics.INFERENCE_QUEUE_DEPTH.labels(*labels).dec()
+
+            metrics.INFERENCE_IN_PROGRESS.labels(*labels).inc()
+            start = perf_counter()
+            try:
+                with metrics.stage("inference", f"{self.module}/{key}"):
+                    yield model
+            finally:
+                metrics.INFERENCE_IN_PROGRESS.labels(*labels).dec()
+                metrics.INFERENCE_SECONDS.labels(*labels).observe(
+                    perf_counter() - start
+                )
+
+    def grown(self, key, load, size: int):
+        # a replica of a resident model was made
+        with self.lock:
+            if self.loads.get(key) is not load:
+                return
+            self.sizes[key] += size
+            metrics.MODEL_MEMORY_BYTES.labels(self.module, key).set(self.sizes[key])
+            evicted = self.evict(keep=key)
+        for pool in evicted:
+            pool.close()
+
+    def evict(self, keep=None):
+        # caller holds self.lock, and closes the evicted pools after releasing it
+        evicted = []
+        if self.memory_budget < 0:
+            return evicted
+        for key in list(self.models):
+            if sum(self.sizes.values()) <= self.memory_budget:
+                break
+            if key != keep:
+                evicted.append(self.models.pop(key))
+                del self.sizes[key]
+                del self.loads[key]
+                metrics.MODEL_MEMORY_BYTES.labels(self.module, key).set(0)
+        return evicted
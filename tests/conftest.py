@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pytest
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+from simplerad import utils
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    # an untrained punkt tokenizer, so the tests need no NLTK downloads; offsets do
+    # not depend on the trained parameters
+    monkeypatch.setattr(utils, "sentence_tokenizer", PunktSentenceTokenizer)
+    utils.preprocess_cache.clear()
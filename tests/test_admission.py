@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import anyio
+import pytest
+from omegaconf import OmegaConf
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+from simplerad.admission import Admission, Rejected, current_limit
+
+
+def make_admission(**endpoint):
+    admission = Admission()
+    admission.set_config(
+        OmegaConf.create(
+            {
+                "enabled": True,
+                "default": {
+                    "max_concurrency": -1,
+                    "max_queue": 10,
+                    "queue_timeout": 0.05,
+                    "max_items": -1,
+                    "lane": "lane",
+                },
+                "endpoints": {"/test/": endpoint},
+                "lanes": {"lane": 1},
+            }
+        )
+    )
+    return admission
+
+
+def free_slots(admission):
+    limit = admission.limit("/test/")
+    return limit.slots._value, admission.lanes["lane"]._value
+
+
+def test_queue_timeout_keeps_slots():
+    async def main():
+        admission = make_admission(max_concurrency=1)
+        limit = admission.limit("/test/")
+        ticket = await admission.admit(limit)
+        with pytest.raises(Rejected) as rejected:
+            await admission.admit(limit)
+        assert rejected.value.status_code == 503
+        ticket.release()
+        assert free_slots(admission) == (1, 1)
+
+    asyncio.run(main())
+
+
+def test_cancelled_while_waiting_for_lane_releases_endpoint_slot():
+    async def main():
+        admission = make_admission(max_concurrency=2, queue_timeout=-1)
+        limit = admission.limit("/test/")
+        ticket = await admission.admit(limit)
+        # holds an endpoint slot while it waits for the lane
+        waiting = asyncio.create_task(admission.admit(limit))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        ticket.release()
+        assert free_slots(admission) == (2, 1)
+
+    asyncio.run(main())
+
+
+def test_slots_released_when_client_leaves_before_body():
+    async def main():
+        admission = make_admission(max_concurrency=1)
+        admission.match = lambda app, scope: SimpleNamespace(path="/test/")
+        scope = {"type": "http", "method": "POST", "path": "/test/", "app": None}
+        request = Request(scope)
+
+        async def call_next(request):
+            return PlainTextResponse("result")
+
+        response = await admission.dispatch(request, call_next)
+        assert free_slots(admission) == (0, 0)
+
+        async def send(message):
+            raise OSError("client disconnected")
+
+        with pytest.raises(OSError):
+            await response({"type": "http"}, None, send)
+        assert free_slots(admission) == (1, 1)
+
+    asyncio.run(main())
+
+
+def test_thread_calls_run_on_the_lane():
+    async def main():
+        admission = make_admission()
+        default = anyio.to_thread.current_default_thread_limiter()
+        running = []
+        seen = []
+
+        def call():
+            running.append(1)
+            seen.append((len(running), default.borrowed_tokens))
+            time.sleep(0.02)
+            running.pop()
+
+        current_limit.set(admission.limit("/test/"))
+        await asyncio.gather(*(admission.run_sync(call) for _ in range(4)))
+        # one thread in the lane, none taken from the shared pool
+        assert seen == [(1, 0)] * 4
+
+    asyncio.run(main())
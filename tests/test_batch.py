@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+from hydra import compose, initialize_config_module
+
+from simplerad.batch import run
+
+
+def config(input_dir, output_dir, **batch):
+    overrides = [
+        f"batch.input_dir={input_dir}",
+        f"batch.output_dir={output_dir}",
+        "batch.modules=[entities]",
+        "batch.workers=0",
+        "entities=stub",
+        *(f"batch.{k}={v}" for k, v in batch.items()),
+    ]
+    with initialize_config_module(config_module="simplerad.conf", version_base=None):
+        return compose(config_name="batch", overrides=overrides)
+
+
+def write_reports(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+
+
+def read_ids(output_dir):
+    return [
+        json.loads(line)["id"]
+        for shard in sorted(output_dir.glob("part-*.jsonl"))
+        for line in shard.read_text().splitlines()
+    ]
+
+
+def test_invalid_reports_keep_input_order(tmp_path):
+    lines = [
+        json.dumps({"id": "a", "text": "Eerste verslag."}),
+        "not json",
+        json.dumps({"id": "c", "text": "Derde verslag."}),
+        json.dumps({"id": "d"}),
+        json.dumps({"id": "e", "text": "Vijfde verslag."}),
+        "5",
+        '"x"',
+        "[1]",
+        json.dumps({"id": "i", "text": 9}),
+        json.dumps({"id": "j", "text": "Tiende verslag."}),
+    ]
+    write_reports(tmp_path / "reports.jsonl", lines)
+    run(config(tmp_path, tmp_path / "out", batch_size=4))
+    assert read_ids(tmp_path / "out") == [
+        "a",
+        "reports.jsonl:2",
+        "c",
+        "reports.jsonl:4",
+        "e",
+        "reports.jsonl:6",
+        "reports.jsonl:7",
+        "reports.jsonl:8",
+        "reports.jsonl:9",
+        "j",
+    ]
+
+
+def test_resume_ignores_nested_output_dir(tmp_path):
+    write_reports(tmp_path / "reports.jsonl", [json.dumps({"text": "Een verslag."})])
+    cfg = config(tmp_path, tmp_path / "out", shard_size=1)
+    run(cfg)
+    shard = (tmp_path / "out" / "part-00000.jsonl").read_text()
+    # the shard written to the nested output dir is not picked up as input
+    run(cfg)
+    assert (tmp_path / "out" / "part-00000.jsonl").read_text() == shard
+    assert len(list((tmp_path / "out").glob("part-*"))) == 1
+
+
+def test_resume_refuses_changed_input(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    (input_dir / "a.txt").write_text("Een verslag.")
+    cfg = config(input_dir, tmp_path / "out")
+    run(cfg)
+    (input_dir / "b.txt").write_text("Nog een verslag.")
+    with pytest.raises(ValueError, match="input files changed"):
+        run(cfg)
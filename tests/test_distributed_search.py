@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import socket
+import threading
+import time
+from time import perf_counter
+
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+from omegaconf import OmegaConf
+
+from simplerad.admission import admission
+from simplerad.entities import entity_taggers
+from simplerad.search import make_searchers
+from simplerad.search.base import BaseSearcher, entity_id
+from simplerad.search.distributed import DistributedSearcher
+from simplerad.search.fuzzy import SimstringJSONLFolderSearcher
+from simplerad.simplerad import create_app
+from simplerad.utils import BackendUnavailableError, ModelRegistry
+
+TITLES = [
+    ["levercirrose", "levercyste", "miltinfarct", "niercyste", "longembolie"],
+    ["leverlaesie", "miltvergroting", "nierinsufficiëntie", "longfibrose"],
+]
+QUERIES = ["lever", "levercyst", "milt", "nier cyste", "longembolie"]
+TIMEOUT = 0.5
+
+
+class SlowSearcher(BaseSearcher):
+    def __init__(self, cfg):
+        pass
+
+    def search(self, text: str):
+        time.sleep(3 * TIMEOUT)
+        return []
+
+
+class FailingSearcher(BaseSearcher):
+    def __init__(self, cfg):
+        pass
+
+    def search(self, text: str):
+        raise RuntimeError("shard failed")
+
+
+def write_entities(path, titles, offset=0):
+    path.mkdir()
+    with open(path / "entities.jsonl", "w") as f:
+        for i, title in enumerate(titles, offset):
+            entity = {"title": title, "description": "", "url": ""}
+            print(json.dumps({**entity, "source": "test", "source_id": str(i)}), file=f)
+
+
+def simstring(path):
+    return OmegaConf.create(
+        {
+            "name": "simstring",
+            "jsonl_directory": str(path),
+            "char_ngram": 3,
+            "cosim_threshold": 0.2,
+        }
+    )
+
+
+def serve(registry):
+    # a shard app of its own on a free port, in a thread of this process
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    config = uvicorn.Config(
+        create_app(registry), host="127.0.0.1", port=port, log_level="warning"
+    )
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture(scope="module")
+def shards(tmp_path_factory):
+    root = tmp_path_factory.mktemp("shards")
+    offset = 0
+    registries = []
+    for i, titles in enumerate(TITLES):
+        write_entities(root / f"shard-{i}", titles, offset)
+        offset += len(titles)
+        registry = make_searchers()
+        registry.set_config(simstring(root / f"shard-{i}"))
+        registries.append(registry)
+    write_entities(root / "all", [t for titles in TITLES for t in titles])
+    slow = ModelRegistry("search", {"slow": SlowSearcher})
+    slow.set_config(OmegaConf.create({"name": "slow"}))
+    failing = ModelRegistry("search", {"failing": FailingSearcher})
+    failing.set_config(OmegaConf.create({"name": "failing"}))
+
+    servers = [serve(r) for r in (*registries, slow, failing)]
+    yield root / "all", [url for _, _, url in servers]
+    for server, thread, _ in servers:
+        server.should_exit = True
+    for server, thread, _ in servers:
+        thread.join()
+
+
+def distributed(urls, **settings):
+    return OmegaConf.create(
+        {
+            "name": "distributed",
+            "shards": urls,
+            "engine": None,
+            "connect_timeout": TIMEOUT,
+            "timeout": TIMEOUT,
+            "pool_size": 2,
+            "min_shards": 1,
+            "max_results": -1,
+            **settings,
+        }
+    )
+
+
+def ranking(results):
+    return [(entity_id(r["entity"]), round(r["score"], 6)) for r in results]
+
+
+def test_merged_like_one_searcher(shards):
+    all_entities, urls = shards
+    plain = SimstringJSONLFolderSearcher(simstring(all_entities))
+    searcher = DistributedSearcher(distributed(urls[:2], score_normalization="none"))
+    try:
+        expected = [
+            sorted(ranking(plain.search(q)), key=lambda x: -x[1]) for q in QUERIES
+        ]
+        results = searcher.search_batch(QUERIES)
+        assert [sorted(ranking(r), key=lambda x: -x[1]) for r in results] == expected
+        for r in results:
+            scores = [x["score"] for x in r]
+            assert scores == sorted(scores, reverse=True)
+    finally:
+        searcher.close()
+
+
+def test_global_max_normalization(shards):
+    _, urls = shards
+    raw = DistributedSearcher(distributed(urls[:2], score_normalization="none"))
+    scaled = DistributedSearcher(distributed(urls[:2]))
+    try:
+        for plain, normalized in zip(
+            raw.search_batch(QUERIES), scaled.search_batch(QUERIES)
+        ):
+            top = plain[0]["score"]
+            assert [entity_id(r["entity"]) for r in normalized] == [
+                entity_id(r["entity"]) for r in plain
+            ]
+            assert [r["score"] for r in normalized] == pytest.approx(
+                [r["score"] / top for r in plain]
+            )
+    finally:
+        raw.close()
+        scaled.close()
+
+
+def test_slow_and_failing_shards_left_out(shards):
+    _, urls = shards
+    searcher = DistributedSearcher(distributed(urls))
+    complete = DistributedSearcher(distributed(urls[:2]))
+    try:
+        start = perf_counter()
+        results = searcher.search_batch(QUERIES)
+        # one deadline for all shards
+        assert perf_counter() - start < 2 * TIMEOUT
+        assert results == complete.search_batch(QUERIES)
+    finally:
+        searcher.close()
+        complete.close()
+
+
+def test_too_few_shards_answer(shards):
+    _, urls = shards
+    searcher = DistributedSearcher(distributed(urls, min_shards=3))
+    try:
+        with pytest.raises(BackendUnavailableError):
+            searcher.search("lever")
+    finally:
+        searcher.close()
+
+
+def test_503_when_every_shard_fails(shards):
+    _, urls = shards
+    registry = make_searchers()
+    registry.set_config(distributed(urls[2:]))
+    client = TestClient(create_app(registry))
+    response = client.post("/search/", json=[{"text": "lever"}])
+    assert response.status_code == 503
+    # the other apps of the process are not affected
+    assert client.get("/engines/").json()["search"] == ["distributed"]
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnraisableExceptionWarning")
+def test_close_after_failed_init():
+    with pytest.raises(ValueError):
+        DistributedSearcher(distributed([]))
+    gc.collect()
+
+
+@pytest.fixture
+def search_max_items():
+    def limit(max_items):
+        default = {
+            "max_concurrency": -1,
+            "max_queue": -1,
+            "queue_timeout": -1,
+            "max_items": -1,
+            "lane": None,
+        }
+        admission.set_config(
+            OmegaConf.create(
+                {
+                    "enabled": True,
+                    "default": default,
+                    "endpoints": {"/search/": {"max_items": max_items}},
+                    "lanes": {},
+                }
+            )
+        )
+
+    yield limit
+    admission.set_config(
+        OmegaConf.create(
+            {"enabled": False, "default": {}, "endpoints": {}, "lanes": {}}
+        )
+    )
+
+
+def test_batches_split_at_max_items(shards, search_max_items):
+    _, urls = shards
+    complete = DistributedSearcher(distributed(urls[:2]))
+    expected = complete.search_batch(QUERIES)
+    search_max_items(2)
+    split = DistributedSearcher(distributed(urls[:2], max_items=2))
+    unsplit = DistributedSearcher(distributed(urls[:2], max_items=-1))
+    try:
+        assert split.search_batch(QUERIES) == expected
+        # every shard answers 413
+        with pytest.raises(BackendUnavailableError):
+            unsplit.search_batch(QUERIES)
+    finally:
+        for searcher in (complete, split, unsplit):
+            searcher.close()
+
+
+def test_linking_uses_the_app_registry(shards):
+    _, urls = shards
+    entity_taggers.set_config(OmegaConf.create({"name": "stub", "min_length": 5}))
+    registry = make_searchers()
+    registry.set_config(distributed(urls[:1]))
+    client = TestClient(create_app(registry))
+    response = client.post("/entities/?link=5", json=[{"text": "Lever levercyste."}])
+    candidates = [
+        entity_id(c["entity"])
+        for span in response.json()[0]["spans"]
+        for c in span["candidates"]
+    ]
+    # only entities of the first shard, the configured searcher is not used
+    assert candidates and all(int(c.split(":")[1]) < len(TITLES[0]) for c in candidates)
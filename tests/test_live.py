@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from omegaconf import OmegaConf
+
+from simplerad import live as live_module
+from simplerad.entities import entity_taggers
+from simplerad.live import live
+from simplerad.simplerad import app
+
+TEXT = "Er is een hypodense laesie in de lever."
+
+
+@pytest.fixture
+def client():
+    entity_taggers.set_config(OmegaConf.create({"name": "stub", "latency_ms": 100}))
+    live.set_config(OmegaConf.create({"debounce": 0.15, "max_delay": 0.3}))
+    yield TestClient(app)
+    live.set_config(OmegaConf.create({"debounce": 0.15, "max_delay": 1.0}))
+
+
+def edit(revision, text=None):
+    text = text or f"{TEXT} Typed{' x' * revision}."
+    return json.dumps({"text": text, "revision": revision, "modules": ["entities"]})
+
+
+def receive_until_done(ws, revision):
+    messages = []
+    while not messages or messages[-1] != revision:
+        message = ws.receive_json()
+        if message.get("done"):
+            assert "error" not in message
+            messages.append(message["revision"])
+    return messages
+
+
+def test_results_while_typing(client):
+    # an edit every 50 ms, never a pause of `debounce`
+    with client.websocket_connect("/live/") as ws:
+        for revision in range(30):
+            ws.send_text(edit(revision))
+            time.sleep(0.05)
+        done = receive_until_done(ws, 29)
+    # analyzed every max_delay while typing, one analysis at a time
+    assert len(done) >= 3
+    assert done == sorted(done)
+
+
+def test_failed_analysis_keeps_the_session(client, monkeypatch):
+    preprocess = live_module.preprocess
+
+    def failing_preprocess(text):
+        if text == "boom":
+            raise ValueError("cannot preprocess")
+        return preprocess(text)
+
+    monkeypatch.setattr(live_module, "preprocess", failing_preprocess)
+    with client.websocket_connect("/live/") as ws:
+        ws.send_text(edit(1, "boom"))
+        assert ws.receive_json() == {
+            "revision": 1,
+            "done": True,
+            "error": "ValueError: cannot preprocess",
+        }
+        ws.send_text(edit(2))
+        assert receive_until_done(ws, 2) == [2]
+
+
+def test_newer_edit_stops_analysis(client):
+    live.set_config(OmegaConf.create({"debounce": 0.05, "max_delay": 5.0}))
+    entity_taggers.set_config(OmegaConf.create({"name": "stub", "latency_ms": 300}))
+    with client.websocket_connect("/live/") as ws:
+        ws.send_text(edit(1))
+        # while the entities of revision 1 are tagged
+        time.sleep(0.2)
+        ws.send_text(edit(2))
+        messages = []
+        while not messages or not (messages[-1].get("done") or "error" in messages[-1]):
+            messages.append(ws.receive_json())
+    assert messages[-1]["revision"] == 2 and "error" not in messages[-1]
+    assert [m.get("module") for m in messages if m["revision"] == 1] == ["preprocess"]
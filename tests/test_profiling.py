@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from omegaconf import OmegaConf
+
+from simplerad import profiling
+from simplerad.profiling import profiler
+from simplerad.search import searchers
+from simplerad.simplerad import app
+
+HEADERS = {"X-Profile": "secret"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    profiler.set_config(
+        OmegaConf.create(
+            {
+                "enabled": True,
+                "token": "secret",
+                "interval": 0.001,
+                "output_dir": str(tmp_path),
+            }
+        )
+    )
+    finished = []
+    monkeypatch.setattr(profiling.RequestProfile, "stop", record(finished))
+    yield TestClient(app, raise_server_exceptions=False), finished
+    profiler.set_config(
+        OmegaConf.create(
+            {
+                "enabled": False,
+                "token": "",
+                "interval": 0.005,
+                "output_dir": str(tmp_path),
+            }
+        )
+    )
+
+
+def record(finished):
+    stop = profiling.RequestProfile.stop
+
+    def recording_stop(self):
+        stop(self)
+        finished.append(self.id)
+
+    return recording_stop
+
+
+def test_profile_finished_when_endpoint_fails(client, monkeypatch):
+    client, finished = client
+    # not configured, so the endpoint raises
+    monkeypatch.setattr(searchers, "default", None)
+    response = client.post("/search/", json=[{"text": "lever"}], headers=HEADERS)
+    assert response.status_code == 500
+    assert len(finished) == 1
+
+
+def test_streamed_profile_covers_the_body(client, tmp_path):
+    client, finished = client
+    searchers.set_config(
+        OmegaConf.create({"name": "exact", "jsonl_directory": str(tmp_path)})
+    )
+    body = "\n".join('{"text": "lever"}' for _ in range(20))
+    response = client.post("/stream/search/", content=body, headers=HEADERS)
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 20
+    assert finished == [response.headers["X-Profile-Id"]]
+    # the model calls made while the body was streamed are part of the profile
+    stored = json.loads((tmp_path / f"{finished[0]}.json").read_text())
+    assert sum(call["stage"] == "inference" for call in stored["calls"]) == 20
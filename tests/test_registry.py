@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gc
+import threading
+import weakref
+
+from omegaconf import OmegaConf
+
+from simplerad.utils import ModelRegistry
+
+MB = 2**20
+
+
+class Model:
+    concurrency = "replicas"
+
+    def __init__(self, cfg):
+        # copied for every replica
+        self.state = bytearray(cfg.get("state_mb", 0) * MB)
+
+
+def use_at_once(registry, engine, calls):
+    # `calls` threads that hold an instance of the model at the same time
+    barrier = threading.Barrier(calls)
+
+    def call():
+        with registry.use(engine):
+            barrier.wait()
+
+    threads = [threading.Thread(target=call) for _ in range(calls)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_replicas_count_memory_mb():
+    registry = ModelRegistry("test", {"a": Model, "b": Model})
+    registry.set_config(
+        OmegaConf.create({"name": "a", "memory_mb": 10, "replicas": 3}),
+        memory_budget_mb=50,
+    )
+    registry.add_config(OmegaConf.create({"name": "b", "memory_mb": 10}))
+    use_at_once(registry, "b", 1)
+    use_at_once(registry, "a", 3)
+    # the loaded model and its three replicas
+    assert registry.sizes["a"] == 40 * MB
+    assert "b" in registry.models
+    # the next replica of a exceeds the budget, b goes
+    registry.set_config(
+        OmegaConf.create({"name": "a", "memory_mb": 10, "replicas": 4}),
+        memory_budget_mb=50,
+    )
+    registry.add_config(OmegaConf.create({"name": "b", "memory_mb": 10}))
+    use_at_once(registry, "b", 1)
+    use_at_once(registry, "a", 4)
+    assert registry.sizes["a"] == 50 * MB
+    assert list(registry.models) == ["a"]
+
+
+def test_replicas_measured():
+    registry = ModelRegistry("test", {"a": Model})
+    registry.set_config(OmegaConf.create({"name": "a", "state_mb": 64, "replicas": 2}))
+    registry.get_pool("a")
+    loaded = registry.sizes["a"]
+    use_at_once(registry, "a", 2)
+    # every replica copies the state of the model
+    assert registry.sizes["a"] - loaded > 100 * MB
+
+
+class Closable(Model):
+    concurrency = "reentrant"
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_evicted_model_freed_and_closed():
+    registry = ModelRegistry("test", {"a": Closable, "b": Closable})
+    registry.set_config(
+        OmegaConf.create({"name": "a", "memory_mb": 10}), memory_budget_mb=15
+    )
+    registry.add_config(OmegaConf.create({"name": "b", "memory_mb": 10}))
+    gc.disable()
+    try:
+        a = registry.get_model("a")
+        freed = weakref.ref(registry.get_pool("a"))
+        with registry.use("b"):
+            pass
+        # no reference cycle keeps the evicted pool alive
+        assert freed() is None
+    finally:
+        gc.enable()
+    assert a.closed
+
+
+def test_model_in_use_closed_when_released():
+    registry = ModelRegistry("test", {"a": Closable})
+    registry.set_config(OmegaConf.create({"name": "a"}))
+    with registry.use("a") as model:
+        registry.set_config(OmegaConf.create({"name": "a"}))
+        assert not model.closed
+    assert model.closed
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from omegaconf import OmegaConf
+
+from simplerad import utils
+from simplerad.entities import entity_taggers
+from simplerad.simplerad import app
+
+TEXTS = [
+    "Geen afwijkingen.  Lever   normaal.\n\nMilt\tvergroot.",
+    "   Voorloop en naloop.   ",
+    "Een zin.\n \n Nog een zin  met\n\n gaten. Einde",
+    "Zonder extra witruimte. Twee zinnen.",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_spans_map_to_original_text(text):
+    preprocessed = utils.preprocess(text)
+    for sentence in preprocessed["sentences"]:
+        for start in range(sentence["start"], sentence["end"]):
+            for end in range(start + 1, sentence["end"] + 1):
+                original_start, original_end = utils.to_original_span(text, start, end)
+                original = text[original_start:original_end]
+                assert re.sub(r"\s+", " ", original) == preprocessed["text"][start:end]
+
+
+def test_entities_original_offsets():
+    entity_taggers.set_config(OmegaConf.create({"name": "stub", "min_length": 5}))
+    client = TestClient(app)
+    response = client.post(
+        "/entities/?original_offsets=true", json=[{"text": TEXTS[0]}]
+    )
+    (result,) = response.json()
+    words = ["afwijkingen", "Lever", "normaal", "vergroot"]
+    assert [s["text"] for s in result["spans"]] == words
+    for span in result["sentences"] + result["spans"]:
+        original = TEXTS[0][span["original_start"] : span["original_end"]]
+        assert re.sub(r"\s+", " ", original) == span["text"]
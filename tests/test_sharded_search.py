@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from omegaconf import OmegaConf
+
+from simplerad.search.fuzzy import (
+    ShardedSimstringSearcher,
+    SimstringJSONLFolderSearcher,
+)
+
+TITLES = [
+    "levercirrose",
+    "leverlaesie",
+    "levercyste",
+    "miltinfarct",
+    "miltvergroting",
+    "nierinsufficiëntie",
+    "niercyste",
+    "longembolie",
+    "longfibrose",
+    "pleuravocht",
+]
+QUERIES = ["lever", "levercyst", "milt", "nier cyste", "longembolie", "x", ""]
+
+
+@pytest.fixture(scope="module")
+def entity_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("entities")
+    with open(path / "entities.jsonl", "w") as f:
+        for i, title in enumerate(TITLES):
+            entity = {"title": title, "description": "", "url": ""}
+            print(json.dumps({**entity, "source": "test", "source_id": str(i)}), file=f)
+    return path
+
+
+def config(entity_dir, **settings):
+    return OmegaConf.create(
+        {
+            "jsonl_directory": str(entity_dir),
+            "char_ngram": 3,
+            "cosim_threshold": 0.2,
+            "max_results": -1,
+            **settings,
+        }
+    )
+
+
+@pytest.mark.parametrize("partition", ["hash", "length"])
+def test_same_results_as_single_process(entity_dir, partition):
+    plain = SimstringJSONLFolderSearcher(config(entity_dir))
+    sharded = ShardedSimstringSearcher(
+        config(entity_dir, shards=3, partition=partition)
+    )
+    try:
+        expected = [plain.search(q) for q in QUERIES]
+        assert [sharded.search(q) for q in QUERIES] == expected
+
+        def search():
+            return [[sharded.search(q) for q in QUERIES] for _ in range(5)]
+
+        # results and exceptions of the threads reach the test through result()
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(search) for _ in range(4)]
+            for future in futures:
+                assert future.result() == [expected] * 5
+    finally:
+        sharded.close()
+
+
+def test_stopped_shard_is_restarted(entity_dir):
+    plain = SimstringJSONLFolderSearcher(config(entity_dir))
+    sharded = ShardedSimstringSearcher(config(entity_dir, shards=3))
+    try:
+        sharded.shards[1].process.kill()
+        sharded.shards[1].process.join()
+        with pytest.raises(RuntimeError):
+            sharded.search("lever")
+        # the other shards are still in step, the stopped one runs again
+        assert [sharded.search(q) for q in QUERIES] == [
+            plain.search(q) for q in QUERIES
+        ]
+    finally:
+        sharded.close()